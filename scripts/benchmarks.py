@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks the mask and score pipeline on synthetic forests and
+trajectories of controlled size, so that speedups can be shown and
+regressions caught without the real data set.
+
+Usage:
+  ./benchmarks.py [results.json] [baseline.json]
+
+Every stage is timed at each scale in SCALES and the results are written
+as JSON (by default to benchmark_results.json). If a baseline written by
+an earlier run is given, then each timing is compared with it and
+slowdowns beyond REGRESSION_RATIO are flagged.
+"""
+
+import sys
+import io
+import json
+import time
+import math
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+
+from fileio import save_dataframe
+import discretize
+import generate_trial_masks
+import score
+
+# forest (trees, mean radius, radius spread) and trajectory (points,
+# speed, heading noise) sizes to benchmark
+SCALES = {'small': {'n_trees': 200, 'mean_r': 0.08, 'r_spread': 0.5
+    ,'n_points': 200, 'speed': 1.0, 'heading_noise': 0.05}
+  ,'medium': {'n_trees': 1000, 'mean_r': 0.08, 'r_spread': 0.5
+    ,'n_points': 1000, 'speed': 1.0, 'heading_noise': 0.05}
+  ,'large': {'n_trees': 5000, 'mean_r': 0.08, 'r_spread': 0.5
+    ,'n_points': 4000, 'speed': 1.0, 'heading_noise': 0.05}}
+KERNEL_PARAMS = [[(-2,0),(2,0)],[(2,1),(2,1)],[1,2]]
+FRAME_RATE = 60.  # points per second of a synthetic trajectory
+REPEATS = 3  # each timing is the best of this many runs
+REGRESSION_RATIO = 1.2  # flag timings this much slower than the baseline
+
+def make_forest(n_trees,mean_r,r_spread,seed=0):
+  """
+  (int,float,float,int) -> pandas.dataframe
+
+  Returns a forest of n_trees x,y,r trees scattered uniformly over a disk
+  sized to hold about one tree per 10 square units, with radii uniform
+  within mean_r*(1 -/+ r_spread).
+  """
+  rng = np.random.default_rng(seed)
+  extent = (10*n_trees/math.pi)**0.5
+  radii = extent*np.sqrt(rng.uniform(0,1,n_trees))
+  theta = rng.uniform(0,2*math.pi,n_trees)
+  return pd.DataFrame({'x': radii*np.cos(theta), 'y': radii*np.sin(theta)
+    ,'r': rng.uniform(mean_r*(1-r_spread),mean_r*(1+r_spread),n_trees)})
+
+def make_trajectory(n_points,speed,heading_noise,seed=0,moth_id='moth1'):
+  """
+  (int,float,float,int,str) -> pandas.dataframe
+
+  Returns a trajectory of n_points that starts at the forest center and
+  moves at a constant speed along a heading that drifts by Gaussian
+  noise (radians per point). It has the columns of a single trial file,
+  so it can be saved and fed to generate_trial_masks.processTrials.
+  """
+  rng = np.random.default_rng(seed)
+  angles = np.cumsum(rng.normal(0,heading_noise,n_points))
+  hx,hy = np.cos(angles),np.sin(angles)
+  step = speed/FRAME_RATE
+  x = np.concatenate(([0.],np.cumsum(hx[:-1]*step)))
+  y = np.concatenate(([0.],np.cumsum(hy[:-1]*step)))
+  return pd.DataFrame({'t': np.arange(n_points)/FRAME_RATE
+    ,'obstacles': 'synthetic', 'moth_id': moth_id
+    ,'flight_speed': float(speed), 'fog_min': 0., 'fog_max': 0.
+    ,'datetime': pd.Timestamp('2000-01-01')
+    ,'pos_x': x, 'pos_y': y, 'head_x': hx, 'head_y': hy})
+
+def time_calls(func,args_list,repeats=REPEATS):
+  """
+  (callable,list,int) -> dict
+
+  Calls func once for every tuple of arguments in args_list, repeats
+  this and returns the number of calls with the best total and per-call
+  time in seconds.
+  """
+  best = float('inf')
+  for irepeat in range(repeats):
+    start = time.perf_counter()
+    for args in args_list:
+      func(*args)
+    best = min(best,time.perf_counter()-start)
+  return {'calls': len(args_list), 'total_s': best, 'per_call_s': best/max(len(args_list),1)}
+
+def run_scale(name,params):
+  """
+  (str,dict) -> list
+
+  Times every stage on a synthetic forest and trajectory of one scale and
+  returns one result per stage.
+  """
+  forest = make_forest(params['n_trees'],params['mean_r'],params['r_spread'])
+  traj = make_trajectory(params['n_points'],params['speed'],params['heading_noise'])
+  points = traj[['pos_x','pos_y','head_x','head_y']].values
+  forest_index = discretize.index_forest(forest)
+  patch_size,min_r = forest_index['patch_size'],forest_index['min_r']
+  patches = [discretize.get_patch(point[0:2],forest_index)[0] for point in points]
+  masks = [discretize.discretize(point[0:2],patch,patch_size,min_r)[0] for point,patch in zip(points,patches)]
+  N = masks[0].shape[0]
+  kernel = score.generateKernel([N,points[0,2],points[0,3]],*KERNEL_PARAMS,rotate=True)
+  quiet = contextlib.redirect_stdout(io.StringIO())
+
+  results = {}
+  results['get_patch'] = time_calls(discretize.get_patch,[(point[0:2],forest_index) for point in points])
+  results['get_patch_dataframe'] = time_calls(discretize.get_patch,[(point[0:2],forest) for point in points[:100]])
+  results['discretize'] = time_calls(discretize.discretize
+    ,[(point[0:2],patch,patch_size,min_r) for point,patch in zip(points,patches)])
+  trial = np.zeros(len(points),dtype=generate_trial_masks.TRIAL_DTYPE)
+  results['pack'] = time_calls(discretize.pack,[(mask,point,ii,trial) for ii,(mask,point) in enumerate(zip(masks,points))])
+  results['generateKernel'] = time_calls(score.generateKernel
+    ,[([N,point[2],point[3]],*KERNEL_PARAMS,True) for point in points[:20]])
+  results['score_frame'] = time_calls(score.score_frame,[(mask,kernel) for mask in masks])
+  with quiet:
+    trial_data = generate_trial_masks.discretize_trial(forest_index,traj[['pos_x','pos_y','head_x','head_y']],'bench')
+    results['score_trial'] = time_calls(score.score_trial,[(trial_data,0,['bench',0,0,0],KERNEL_PARAMS)],repeats=1)
+  results['score_trial_batched'] = time_calls(score.score_trial_batched,[(trial_data,KERNEL_PARAMS)])
+
+  with tempfile.TemporaryDirectory() as tmp:
+    trial_path = tmp+'/bench_000f0.h5'
+    save_dataframe(traj,'h5',trial_path)
+    with quiet, open(tmp+'/trial_log','wb') as log:
+      results['processTrials'] = time_calls(generate_trial_masks.processTrials
+        ,[([trial_path],forest,tmp+'/masks',log)],repeats=1)
+
+  return [dict(stage=stage,scale=name,params=params,**timing) for stage,timing in results.items()]
+
+def compare(results,baseline):
+  """
+  (list,list) -> list
+
+  Pairs each result with the baseline result of the same stage and scale
+  and returns (stage,scale,baseline per call,per call,ratio) rows.
+  """
+  old = {(r['stage'],r['scale']): r for r in baseline}
+  rows = []
+  for r in results:
+    b = old.get((r['stage'],r['scale']))
+    if (b is not None):
+      rows.append((r['stage'],r['scale'],b['per_call_s'],r['per_call_s'],r['per_call_s']/b['per_call_s']))
+  return rows
+
+def main():
+  out_path = sys.argv[1] if 1 < len(sys.argv) else "benchmark_results.json"
+  baseline_path = sys.argv[2] if 2 < len(sys.argv) else None
+
+  results = []
+  for name,params in SCALES.items():
+    print("benchmarking: "+name)
+    results += run_scale(name,params)
+  report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+      ,'python': platform.python_version(), 'numpy': np.__version__
+      ,'pandas': pd.__version__, 'machine': platform.platform()}
+    ,'results': results}
+  with open(out_path,'w') as handle:
+    json.dump(report,handle,indent=1)
+
+  print("{:<22s}{:<8s}{:>8s}{:>14s}".format("stage","scale","calls","per call (s)"))
+  for r in results:
+    print("{:<22s}{:<8s}{:>8d}{:>14.3e}".format(r['stage'],r['scale'],r['calls'],r['per_call_s']))
+  print("saved @ "+out_path)
+
+  if (baseline_path is not None):
+    with open(baseline_path) as handle:
+      baseline = json.load(handle)['results']
+    print("\ncompared with "+baseline_path)
+    for stage,scale,before,after,ratio in compare(results,baseline):
+      flag = " (!) slower" if REGRESSION_RATIO < ratio else ""
+      print("{:<22s}{:<8s}{:>12.3e}{:>12.3e}{:>8.2f}x{:s}".format(stage,scale,before,after,ratio,flag))
+  return
+
+if (__name__ == "__main__"):
+  main()
@@ -6,6 +6,8 @@
 # This script appends script sub-directories to the PYTHONPATH env
 # variable. The path needs to be configured so that pyscripts can
 # reference those that are contained in sub-directories.
+# Third-party packages are listed in requirements.txt; install them with
+# $ pip install -r requirements.txt
 
 scripts_dir=`pwd`
 export PYTHONPATH=$PYTHONPATH:"$scripts_dir"/fileio_and_visual:"$scripts_dir"/preprocess_trajs:"$scripts_dir"/score_trajs
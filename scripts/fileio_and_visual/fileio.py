@@ -1,7 +1,11 @@
 #!/usr/bin/python3
 
 import pandas as pd
+import numpy as np
 import os
+from logs import get_logger
+
+logger = get_logger('fileio')
 
 def load_dataframe(file_format,file_path):
   """
@@ -26,7 +30,7 @@ def load_dataframe(file_format,file_path):
   if(not os.path.isfile(file_path)):
     raise FileNotFoundError("(!) ERROR: {:s} does not exist.".format(file_path))
 
-  print("loading: "+file_path)
+  logger.info("loading: %s",file_path)
   dt = None
   if(file_format == 'csv'):
     dt = pd.read_csv(file_path,delimiter=',')
@@ -37,10 +41,10 @@ def load_dataframe(file_format,file_path):
     try:
      dt = pd.read_hdf(file_path,key)
     except KeyError:
-     print("Key {:s} doesn't exist, so can't load data from {:s}.".format(key,file_path))
+     logger.error("Key %s doesn't exist, so can't load data from %s.",key,file_path)
 
   else:
-    print("(!) load_data: file file_format, "+file_format+", is unrecognized.")
+    logger.error("(!) load_data: file file_format, %s, is unrecognized.",file_format)
 
 
   return dt
@@ -67,7 +71,7 @@ def save_dataframe(data_frame,file_format,file_path):
     try:
       data_frame.to_csv(file_path,index=False)
     except OSError:
-      print("(!) You passed a directory path instead of a file path.")
+      logger.error("(!) You passed a directory path instead of a file path.")
   elif (file_format == 'h5'):
     filename = file_path.split('/')[-1]
     # replace default key with filename
@@ -75,16 +79,144 @@ def save_dataframe(data_frame,file_format,file_path):
     if (filename.split('.')[0] != filename):
       key = filename.split('.')[0]
     else:
-      print("(!) Saving {:s} with key={:s}".format(file_path,key))
+      logger.warning("(!) Saving %s with key=%s",file_path,key)
     try:
       data_frame.to_hdf(file_path,key=key,format='table',mode='w')
     except OSError:
-      print("(!) You passed a directory path instead of a file path.")
+      logger.error("(!) You passed a directory path instead of a file path.")
   else:
-    print("(!) save_data: file file_format, "+file_format+", is unrecognized.")
+    logger.error("(!) save_data: file file_format, %s, is unrecognized.",file_format)
 
   return
 
+# columns of the bulk moth data that identify the conditions of a trial
+# and that trials are selected by; trials are grouped in this order
+CONDITION_COLUMNS = ['obstacles','moth_id','flight_speed','fog_min','fog_max']
+# columns of a trial's trajectory that its masks are computed from
+TRAJ_COLUMNS = ['pos_x','pos_y','head_x','head_y']
+# widest string expected in each string condition column
+CONDITION_ITEMSIZE = {'moth_id': 16, 'obstacles': 32}
+
+def convert_to_table(src_path,dst_path,key="data",src_key=None,chunksize=500000):
+  """
+  (str,str,str,str,int) -> int
+
+  Copies an hdf data frame into a queryable hdf table at dst_path whose
+  condition columns (see CONDITION_COLUMNS) are indexed data columns, so
+  rows can be selected with select_table without reading the whole file.
+  If the source was saved in table format (e.g., by save_dataframe), it is
+  copied chunksize rows at a time and memory stays bounded; a fixed
+  format source has to be read whole once. src_key defaults to the source
+  filename, as in load_dataframe. Returns the number of rows copied.
+  """
+  if(not os.path.isfile(src_path)):
+    raise FileNotFoundError("(!) ERROR: {:s} does not exist.".format(src_path))
+  if (src_key is None):
+    src_key = src_path.split('/')[-1].split('.')[0]
+
+  with pd.HDFStore(src_path,mode='r') as src:
+    storer = src.get_storer(src_key)
+    if (storer.is_table):
+      chunks = src.select(src_key,chunksize=chunksize)
+    else:
+      logger.warning("(!) convert_to_table: %s is not a table, so it is read whole.",src_path)
+      chunks = [src.select(src_key)]
+    nrows = 0
+    with pd.HDFStore(dst_path,mode='w') as dst:
+      for chunk in chunks:
+        data_columns = [c for c in CONDITION_COLUMNS if c in chunk.columns]
+        itemsize = {c: n for c,n in CONDITION_ITEMSIZE.items() if c in chunk.columns}
+        dst.append(key,chunk,format='table',data_columns=data_columns
+          ,min_itemsize=itemsize,index=False)
+        nrows += len(chunk)
+      # index the condition columns once all rows are in
+      dst.create_table_index(key,columns=data_columns,optlevel=6,kind='medium')
+  return nrows
+
+def condition_query(conditions):
+  """
+  (dict) -> str
+
+  Builds a where query for select_table that matches every
+  column == value pair in conditions.
+
+  >>> condition_query({'moth_id':'moth1','flight_speed':4.0})
+  "moth_id == 'moth1' & flight_speed == 4.0"
+  """
+  # numpy scalars are queried as plain python values
+  return " & ".join("{:s} == {!r}".format(c,v if isinstance(v,str) else float(v))
+    for c,v in conditions.items())
+
+def select_table(file_path,conditions,key="data",columns=None):
+  """
+  (str,dict,str,list) -> pandas.dataframe
+
+  Reads only the rows of an hdf table written by convert_to_table whose
+  condition columns match conditions, e.g.,
+  {'moth_id':'moth1','obstacles':'bright','flight_speed':4.0,...}.
+  The original row index is kept. Only the given columns are read, if any.
+  """
+  if(not os.path.isfile(file_path)):
+    raise FileNotFoundError("(!) ERROR: {:s} does not exist.".format(file_path))
+  return pd.read_hdf(file_path,key,where=condition_query(conditions),columns=columns)
+
+def iter_table(file_path,key="data",chunksize=500000,conditions=None,columns=None):
+  """
+  (str,str,int,dict,list) -> iterator of pandas.dataframe
+
+  Yields an hdf table chunksize rows at a time, optionally only the rows
+  matching conditions (see select_table).
+  """
+  if(not os.path.isfile(file_path)):
+    raise FileNotFoundError("(!) ERROR: {:s} does not exist.".format(file_path))
+  where = condition_query(conditions) if conditions else None
+  with pd.HDFStore(file_path,mode='r') as store:
+    for chunk in store.select(key,where=where,columns=columns,chunksize=chunksize):
+      yield chunk
+
+# columns of a forest; each tree is one x,y,r row
+FOREST_COLUMNS = ['x','y','r']
+
+def forest_batch_dtype(n_trees):
+  """
+  (int) -> numpy.dtype
+
+  Returns the record type of one forest in a forest batch: its id, the
+  seed it was sampled with and its (n_trees,3) array of x,y,r trees.
+  """
+  return np.dtype([('id','<i8'),('seed','<u8'),('trees','<f8',(n_trees,len(FOREST_COLUMNS)))])
+
+def save_forest_batch(batch,file_path):
+  """
+  (numpy.ndarray,str) -> None
+
+  Saves a batch of forests (see forest_batch_dtype) as one .npy file.
+  """
+  np.save(file_path,batch)
+
+def load_forest_batch(file_path,mmap_mode='r'):
+  """
+  (str,str) -> numpy.ndarray
+
+  Opens a batch of forests saved by save_forest_batch. By default, the
+  file is memory mapped, so only the forests that are used are read.
+  """
+  if(not os.path.isfile(file_path)):
+    raise FileNotFoundError("(!) ERROR: {:s} does not exist.".format(file_path))
+  return np.load(file_path,mmap_mode=mmap_mode)
+
+def forest_from_batch(batch,index):
+  """
+  (numpy.ndarray,int) -> pandas.dataframe
+
+  Returns forest number index of a batch as a data frame of x,y,r trees,
+  like a forest loaded from csv. Only that forest is read from a memory
+  mapped batch.
+  """
+  if (index < 0 or len(batch) <= index):
+    raise IndexError("(!) ERROR: the batch has no forest {:d}.".format(index))
+  return pd.DataFrame(np.array(batch[index]['trees']),columns=FOREST_COLUMNS)
+
 """ DOC TESTS """
 if __name__ == "__main__":
   import doctest
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+"""
+Opt-in stage timers and counters for the mask and score pipelines.
+
+Collection is off until enable() is called. While it is off, start()
+returns None and stop() and count() return at once, so the calls can stay
+in hot loops of production runs. A run is a dictionary of stages, each
+with its number of calls and total/min/max seconds, and counters, each
+with its number of samples and total/min/max value (e.g., trees per patch
+or bytes written). Runs are saved as JSON with write_report and printed
+with summary.
+
+  t0 = instrument.start()
+  [patch,sz] = discretize.get_patch(xy,forest)
+  instrument.stop('get_patch',t0)
+  instrument.count('trees_per_patch',len(patch))
+"""
+
+import time
+import json
+import sys
+
+# the run being collected, or None when collection is off
+report = None
+
+def new_report(name=""):
+  """
+  (str) -> dict
+
+  Returns an empty run labeled name.
+  """
+  return {'name': name
+    ,'started': time.strftime('%Y-%m-%dT%H:%M:%S')
+    ,'argv': list(sys.argv)
+    ,'wall_s': 0.
+    ,'clock': time.perf_counter()
+    ,'stages': {}
+    ,'counters': {}}
+
+def enable(name=""):
+  """
+  (str) -> dict
+
+  Starts collecting into a new run, which is returned.
+  """
+  global report
+  report = new_report(name)
+  return report
+
+def disable():
+  """
+  () -> dict
+
+  Stops collecting and returns the run collected so far, or None.
+  """
+  global report
+  run,report = report,None
+  return run
+
+def enabled():
+  """
+  () -> bool
+
+  Returns whether timers and counters are being collected.
+  """
+  return report is not None
+
+def start():
+  """
+  () -> float
+
+  Returns the time at which a stage starts, to be passed to stop, or None
+  if collection is off.
+  """
+  if (report is None):
+    return None
+  return time.perf_counter()
+
+def add_sample(table,name,value,n=1):
+  """
+  (dict,str,float,int) -> None
+
+  Adds n samples that sum to value to the statistics of name in a table
+  of stages or counters.
+  """
+  entry = table.get(name)
+  if (entry is None):
+    table[name] = {'n': n, 'total': value, 'min': value, 'max': value}
+    return
+  entry['n'] += n
+  entry['total'] += value
+  entry['min'] = min(entry['min'],value)
+  entry['max'] = max(entry['max'],value)
+
+def stop(stage,t0):
+  """
+  (str,float) -> None
+
+  Records the seconds since t0, from start, as one call of stage.
+  """
+  if (t0 is None or report is None):
+    return
+  add_sample(report['stages'],stage,time.perf_counter()-t0)
+
+def count(counter,value=1):
+  """
+  (str,float) -> None
+
+  Records one sample of a counter, e.g., count('frames') or
+  count('bytes_written',size).
+  """
+  if (report is None):
+    return
+  add_sample(report['counters'],counter,value)
+
+def take():
+  """
+  () -> dict
+
+  Returns the stages and counters collected so far and clears them, e.g.,
+  so that a worker process can send them back with its results.
+  """
+  if (report is None):
+    return None
+  collected = {'stages': report['stages'], 'counters': report['counters']}
+  report['stages'],report['counters'] = {},{}
+  return collected
+
+def merge(collected):
+  """
+  (dict) -> None
+
+  Adds stages and counters from take (e.g., of a worker process) to the
+  run being collected.
+  """
+  if (report is None or collected is None):
+    return
+  for table in ['stages','counters']:
+    for name,entry in collected[table].items():
+      current = report[table].get(name)
+      if (current is None):
+        report[table][name] = dict(entry)
+      else:
+        current['n'] += entry['n']
+        current['total'] += entry['total']
+        current['min'] = min(current['min'],entry['min'])
+        current['max'] = max(current['max'],entry['max'])
+
+def finish(run):
+  """
+  (dict) -> dict
+
+  Returns a copy of a run, with its wall time, that can be saved as JSON.
+  """
+  done = {k: v for k,v in run.items() if k != 'clock'}
+  done['wall_s'] = time.perf_counter()-run['clock']
+  return done
+
+def write_report(file_path,run=None):
+  """
+  (str,dict) -> dict
+
+  Saves a run (by default, the one being collected) as JSON and returns
+  what was saved.
+  """
+  done = finish(run if run is not None else report)
+  with open(file_path,'w') as handle:
+    json.dump(done,handle,indent=1)
+  return done
+
+def summary(run=None):
+  """
+  (dict) -> str
+
+  Returns a table of a run's stages, slowest first, with their share of
+  the wall time, followed by its counters. Stages timed in worker
+  processes add up, so their share can exceed 100%.
+  """
+  done = finish(run if run is not None else report)
+  wall = max(done['wall_s'],1e-12)
+  lines = ["run {:s}: {:.3f} s".format(done['name'],done['wall_s'])
+    ,"{:<24s}{:>10s}{:>12s}{:>12s}{:>8s}".format("stage","calls","total (s)","mean (s)","% wall")]
+  stages = sorted(done['stages'].items(),key=lambda item: -item[1]['total'])
+  for name,s in stages:
+    lines.append("{:<24s}{:>10d}{:>12.4f}{:>12.3e}{:>8.1f}".format(name,s['n'],s['total'],s['total']/s['n'],100*s['total']/wall))
+  if (len(done['counters']) > 0):
+    lines.append("{:<24s}{:>10s}{:>12s}{:>12s}{:>12s}".format("counter","samples","total","mean","max"))
+    for name,c in sorted(done['counters'].items()):
+      lines.append("{:<24s}{:>10d}{:>12.6g}{:>12.6g}{:>12.6g}".format(name,c['n'],c['total'],c['total']/c['n'],c['max']))
+  return '\n'.join(lines)
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+"""
+Loggers for the scripts, in place of print. Every module logs through
+get_logger(<module name>), under one LOG_ROOT logger that writes bare
+messages to stdout at INFO by default, so the output looks as it did
+when it was printed. Levels can be set for all modules or for each one,
+with configure or, without editing a script, through the LOG_ENV
+environment variable, e.g.,
+
+  MOTHNAV_LOG="WARNING,fileio=INFO,score=DEBUG" ./generate_trial_masks.py
+
+Pass format arguments to the logger instead of formatting messages
+(logger.debug("pt %d", cnt)), so nothing is formatted at disabled levels.
+Warnings that repeat, e.g., once per frame, go through log_limited.
+"""
+
+import logging
+import sys
+import os
+
+LOG_ROOT = "mothnav"
+LOG_ENV = "MOTHNAV_LOG"
+LOG_FORMAT = "%(message)s"
+REPEAT_LIMIT = 10  # times a repeated message is logged before it is thinned
+
+# occurrences of each rate limited message, by (logger name,key)
+repeat_counts = {}
+
+class StdoutHandler(logging.StreamHandler):
+  """
+  A stream handler that writes to whatever sys.stdout is when a record is
+  emitted, so that redirected or captured stdout (e.g., in doctests) also
+  gets log messages.
+  """
+  @property
+  def stream(self):
+    return sys.stdout
+
+  @stream.setter
+  def stream(self,value):
+    pass
+
+def parse_levels(spec):
+  """
+  (str) -> (str,dict)
+
+  Splits a level spec into the default level and the levels of modules.
+
+  >>> parse_levels("WARNING,score=DEBUG")
+  ('WARNING', {'score': 'DEBUG'})
+  """
+  default,levels = None,{}
+  for item in spec.split(','):
+    item = item.strip()
+    if ('=' in item):
+      module,level = item.split('=',1)
+      levels[module.strip()] = level.strip().upper()
+    elif (item):
+      default = item.upper()
+  return default,levels
+
+def configure(level=None,levels=None,fmt=LOG_FORMAT):
+  """
+  (str or int,dict,str) -> logging.Logger
+
+  Sets the default level of every module's logger and, optionally, the
+  levels of some modules, e.g., configure("INFO",{"score":"WARNING"}).
+  Levels in LOG_ENV override both. Returns the root logger of the scripts.
+  """
+  root = logging.getLogger(LOG_ROOT)
+  if (not root.handlers):
+    handler = StdoutHandler()
+    root.addHandler(handler)
+    root.propagate = False
+  for handler in root.handlers:
+    handler.setFormatter(logging.Formatter(fmt))
+
+  env_default,env_levels = parse_levels(os.environ.get(LOG_ENV,""))
+  root.setLevel(env_default or level or logging.INFO)
+  levels = dict(levels or {})
+  levels.update(env_levels)
+  for module,module_level in levels.items():
+    logging.getLogger(LOG_ROOT+'.'+module).setLevel(module_level)
+  return root
+
+def get_logger(name):
+  """
+  (str) -> logging.Logger
+
+  Returns the logger of a module, configuring the scripts' root logger on
+  first use.
+  """
+  if (not logging.getLogger(LOG_ROOT).handlers):
+    configure()
+  return logging.getLogger(LOG_ROOT+'.'+name)
+
+def log_limited(logger,level,key,msg,*args):
+  """
+  (logging.Logger,int,str,str,...) -> None
+
+  Logs a message that may repeat many times. The first REPEAT_LIMIT
+  occurrences of key are logged; after that, only the 100th, 1000th, ...
+  are, with the number of occurrences so far.
+  """
+  if (not logger.isEnabledFor(level)):
+    return
+  count = repeat_counts.get((logger.name,key),0) + 1
+  repeat_counts[(logger.name,key)] = count
+  if (count <= REPEAT_LIMIT):
+    logger.log(level,msg,*args)
+  elif (str(count).rstrip('0') == '1'):
+    # a power of ten
+    logger.log(level,msg+" (repeated %d times)",*args,count)
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+"""
+A content-addressed, on-disk cache of pipeline artifacts (e.g., the
+discretized frames of a trial). Each artifact is a pickle named by a hash
+of everything it was computed from, so a changed input simply misses.
+Entries are touched when read, and once the cache grows past its size
+limit the least recently used entries are removed.
+"""
+
+import numpy as np
+import hashlib
+import pickle
+import os
+
+CACHE_SUFFIX = ".pickle"
+
+def hash_arrays(*arrays):
+  """
+  (numpy.ndarray,...) -> str
+
+  Returns a hex digest of the dtypes, shapes and contents of the arrays.
+
+  >>> hash_arrays(np.arange(3)) == hash_arrays(np.arange(3))
+  True
+  >>> hash_arrays(np.arange(3)) == hash_arrays(np.arange(3.))
+  False
+  """
+  digest = hashlib.sha256()
+  for arr in arrays:
+    arr = np.ascontiguousarray(arr)
+    digest.update(repr((arr.dtype.str,arr.shape)).encode())
+    digest.update(arr.tobytes())
+  return digest.hexdigest()
+
+def hash_params(params):
+  """
+  (dict) -> str
+
+  Returns a hex digest of a dictionary of parameters, independent of the
+  order of its keys.
+
+  >>> hash_params({'a':1,'b':2}) == hash_params({'b':2,'a':1})
+  True
+  """
+  return hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest()
+
+def cache_key(*parts):
+  """
+  (str,...) -> str
+
+  Combines hex digests (e.g., of a trial, a forest and parameters) into
+  one cache key.
+  """
+  return hashlib.sha256('/'.join(parts).encode()).hexdigest()
+
+def cache_get(cache_dir,key):
+  """
+  (str,str) -> object
+
+  Returns the artifact stored under key, or None if there is none. A hit
+  marks the entry as recently used.
+  """
+  path = cache_dir+'/'+key+CACHE_SUFFIX
+  try:
+    with open(path,'rb') as handle:
+      artifact = pickle.load(handle)
+    os.utime(path)
+  except (FileNotFoundError,EOFError,pickle.UnpicklingError):
+    # missing, or removed or truncated by another process
+    return None
+  return artifact
+
+def cache_put(cache_dir,key,artifact,max_bytes=None):
+  """
+  (str,str,object,int) -> None
+
+  Stores an artifact under key. The file is written under a temporary
+  name and renamed into place, so concurrent readers and writers never see
+  a partial entry. If max_bytes is given, then least recently used
+  entries are evicted until the cache fits (see evict_cache).
+  """
+  if not os.path.exists(cache_dir):
+    os.makedirs(cache_dir,exist_ok=True)
+  path = cache_dir+'/'+key+CACHE_SUFFIX
+  tmp_path = path+'.'+str(os.getpid())
+  with open(tmp_path,'wb') as handle:
+    pickle.dump(artifact,handle,protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp_path,path)
+  if (max_bytes is not None):
+    evict_cache(cache_dir,max_bytes)
+
+def evict_cache(cache_dir,max_bytes):
+  """
+  (str,int) -> int
+
+  Removes the least recently used entries of a cache until its entries
+  take at most max_bytes. Returns the number of entries removed.
+  """
+  entries = []
+  with os.scandir(cache_dir) as scan:
+    for entry in scan:
+      if (entry.name.endswith(CACHE_SUFFIX)):
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime,stat.st_size,entry.path))
+  total = sum(size for mtime,size,path in entries)
+  removed = 0
+  for mtime,size,path in sorted(entries):
+    if (total <= max_bytes):
+      break
+    try:
+      os.remove(path)
+      removed += 1
+    except FileNotFoundError:
+      pass
+    total -= size
+  return removed
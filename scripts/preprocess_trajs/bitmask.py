@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# number of set bits in each byte value, for numpy without bitwise_count
+POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)],dtype=np.uint8)
+
+def popcount(bits,axis=-1):
+  """
+  (numpy.ndarray,int) -> numpy.ndarray
+
+  Counts the set bits of a uint8 array along an axis.
+
+  >>> popcount(np.array([[255,1],[3,0]],dtype=np.uint8))
+  array([9, 2])
+  """
+  if (hasattr(np,'bitwise_count')):
+    counts = np.bitwise_count(bits)
+  else:
+    counts = POPCOUNT_TABLE[bits]
+  return counts.sum(axis=axis,dtype=np.int64)
+
+def pack_masks(masks):
+  """
+  (numpy.ndarray) -> dict
+
+  Bit packs a (frames,N,N) stack of masks, e.g., from score.stack_masks
+  or mask_store.read_masks. Tree cells (1) and markers for the moth and
+  tree centers (-1) are kept as separate bitplanes, each a uint8
+  (frames,ceil(N*N/8)) array of row-major cells. A frame takes 2 bits
+  per cell instead of the 64 of an int or float mask.
+
+  >>> bits = pack_masks(np.array([[[1,0],[-1,1]]]))
+  >>> bits['occupancy'], bits['markers'], bits['n_bins']
+  (array([[144]], dtype=uint8), array([[32]], dtype=uint8), 2)
+  """
+  masks = np.asarray(masks)
+  if (masks.ndim == 2):
+    masks = masks[np.newaxis]
+  flat = masks.reshape(len(masks),-1)
+  return {'occupancy': np.packbits(flat == 1,axis=1)
+    ,'markers': np.packbits(flat == -1,axis=1)
+    ,'n_bins': masks.shape[1]}
+
+def unpack_masks(bits,start=0,stop=None,out=None):
+  """
+  (dict,int,int,numpy.ndarray) -> numpy.ndarray
+
+  Unpacks frames [start,stop) of a packed stack into a float
+  (frames,N,N) stack of 1, -1 and 0 cells for scoring with weighted
+  kernels. A buffer may be passed as out so that chunks can reuse it;
+  only its first stop-start frames are used.
+
+  >>> bits = pack_masks(np.array([[[1,0],[-1,1]]]))
+  >>> unpack_masks(bits)
+  array([[[ 1.,  0.],
+          [-1.,  1.]]])
+  """
+  N = bits['n_bins']
+  stop = len(bits['occupancy']) if stop is None else min(stop,len(bits['occupancy']))
+  nframes = stop - start
+  if (out is None):
+    out = np.empty((nframes,N,N),dtype=float)
+  else:
+    out = out[:nframes]
+  occupancy = np.unpackbits(bits['occupancy'][start:stop],axis=1,count=N*N)
+  markers = np.unpackbits(bits['markers'][start:stop],axis=1,count=N*N)
+  np.subtract(occupancy,markers,out=out.reshape(nframes,N*N),dtype=float,casting='unsafe')
+  return out
+
+def pack_support(kernel):
+  """
+  (numpy.ndarray) -> (numpy.ndarray,float) or (None,None)
+
+  If every nonzero cell of an NxN kernel has the same value (a uniform or
+  box kernel), then returns its nonzero cells packed like a bitplane of
+  pack_masks, and that value. Otherwise, returns None,None.
+
+  >>> pack_support(np.array([[0,2],[2,0]]))
+  (array([96], dtype=uint8), 2.0)
+  """
+  kernel = np.asarray(kernel)
+  support = kernel != 0
+  values = np.unique(kernel[support])
+  if (len(values) > 1):
+    return None,None
+  value = float(values[0]) if len(values) == 1 else 0.0
+  return np.packbits(support.reshape(-1)),value
@@ -3,9 +3,26 @@
 import numpy as np
 import pandas as pd
 import sys
-from scipy.sparse import bsr_matrix
+import functools
+from scipy.sparse import bsr_matrix, csr_matrix
+import logging
+from logs import get_logger, log_limited
+
+logger = get_logger('discretize')
 
 PAD = 1  # patches are padded with PAD*max(tree radius)
+STENCIL_CACHE_SIZE = 4096  # max number of tree stencils kept by disk_stencil
+MASK_VERSION = 2  # bump whenever the rules that turn a forest into masks change
+
+def mask_params():
+  """
+  () -> dict
+
+  Returns the settings that, with the forest and trajectory, determine
+  every mask: the padding, the bin size rule and MASK_VERSION. Cached
+  masks are keyed by these (see artifact_cache).
+  """
+  return {'version': MASK_VERSION, 'PAD': PAD, 'bin_size': 'min_r/2'}
 
 def pack(mat,data,ii,arr):
   """
@@ -18,31 +35,170 @@ def pack(mat,data,ii,arr):
   the boundaries of the array, then the edges (i.e., 0 and len(array)-1)
   are overwritten; and a warning is uttered.
   If data is not length 4, then a warning message is given and NaN
-  values are packed into the array.
+  values are packed into the array. Repeated warnings are rate limited
+  (see logs.log_limited).
   """
-  if (data == None or len(data) != 4):
-    print("discretize.pack: WARN: Data is invalid length.")
+  if (data is None or len(data) != 4):
+    log_limited(logger,logging.WARNING,'pack_data',"discretize.pack: WARN: Data is invalid length.")
     data=[float('NaN')]*4
   if (ii < 0 or len(arr) <= ii):
-    print("discretize.pack: WARN: Overwritting list data")
-    bounded_index = min(max(ii,0),len(arr))
-    sparse_mat = bsr_matrix(mat).tobsr()
-    arr[bounded_index] = (sparse_mat,data[0],data[1],data[2],data[3])
+    log_limited(logger,logging.WARNING,'pack_index',"discretize.pack: WARN: Overwritting list data")
+  bounded_index = min(max(ii,0),len(arr)-1)
+  sparse_mat = bsr_matrix(mat).tobsr()
+  arr[bounded_index] = (sparse_mat,data[0],data[1],data[2],data[3])
   return
 
+def grid_index(xy,cell_size):
+  """
+  (numpy.ndarray,float) -> dict
+
+  Builds a uniform grid of cells cell_size long over an (n,2) array of
+  x,y positions. Returns the row-major id of the cell holding each
+  position ('cell_ids', sorted) with the positions' order ('order'), the
+  cell size, the position of cell (0,0) and the number of rows and
+  columns of cells.
+  """
+  x0,y0 = xy[:,0].min(),xy[:,1].min()
+  icol = np.floor((xy[:,0]-x0)/cell_size).astype(np.int64)
+  irow = np.floor((xy[:,1]-y0)/cell_size).astype(np.int64)
+  ncols,nrows = int(icol.max())+1,int(irow.max())+1
+  cell_ids = irow*ncols + icol
+  # stable sort keeps the input order within a cell
+  order = np.argsort(cell_ids,kind='stable')
+  return {'order':order
+    ,'cell_ids':cell_ids[order]
+    ,'cell_size':cell_size
+    ,'origin':(x0,y0)
+    ,'shape':(nrows,ncols)}
+
+def grid_pairs(grid,xy,reach=1):
+  """
+  (dict,numpy.ndarray,int) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the query and item numbers of every pair where an item of a
+  grid_index lies within reach cells of a query's cell, i.e., in the 3x3
+  cells about it by default. Queries are an (m,2) array of x,y. With
+  cells one patch long, these are the candidates that in_patch has to
+  test. Pairs are grouped by query.
+
+  Example:
+  >>> grid = grid_index(np.array([[0.,0.],[0.5,0.],[3.,3.]]),1.)
+  >>> grid_pairs(grid,np.array([[0.2,0.2],[3.,2.]]))
+  (array([0, 0, 1]), array([0, 1, 2]))
+  """
+  x0,y0 = grid['origin']
+  nrows,ncols = grid['shape']
+  cell_size = grid['cell_size']
+  icol = np.floor((xy[:,0]-x0)/cell_size).astype(np.int64)
+  irow = np.floor((xy[:,1]-y0)/cell_size).astype(np.int64)
+  offsets = np.arange(-reach,reach+1)
+  dcol,drow = np.meshgrid(offsets,offsets)
+  cols = icol[:,np.newaxis] + dcol.reshape(1,-1)
+  rows = irow[:,np.newaxis] + drow.reshape(1,-1)
+  valid = (0 <= cols) & (cols < ncols) & (0 <= rows) & (rows < nrows)
+  neighbor_ids = rows*ncols + cols
+
+  lo = np.searchsorted(grid['cell_ids'],neighbor_ids,side='left')
+  hi = np.searchsorted(grid['cell_ids'],neighbor_ids,side='right')
+  counts = np.where(valid,hi-lo,0).reshape(-1)
+  total = int(counts.sum())
+  if (total == 0):
+    return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.int64)
+  # expand every (query,cell) range into its sorted item positions
+  starts = np.repeat(lo.reshape(-1),counts)
+  steps = np.arange(total) - np.repeat(np.cumsum(counts)-counts,counts)
+  items = grid['order'][starts+steps]
+  queries = np.repeat(np.repeat(np.arange(len(xy)),len(offsets)**2),counts)
+  return queries,items
+
+def index_forest(forest):
+  """
+  (pandas.dataframe) -> dict
+
+  Builds a uniform grid over the tree centers of a forest so that
+  patches can be looked up without scanning every tree. The grid cells
+  are patch_size long, so the square neighborhood about any origin only
+  touches a 3x3 block of cells. Trees are stored as an (n,3) array of
+  x,y,r sorted by the row-major id of the cell holding their center.
+  The index is built once per forest and passed to get_patch in place
+  of the forest dataframe.
+
+  Example:
+  >>> trees = pd.DataFrame([[0.,0.5,0.1],[3.,0.,0.2],[0.2,-0.4,0.1],[-1.9,0.,0.1]],columns=['x','y','r'])
+  >>> forest_index = index_forest(trees)
+  >>> forest_index['shape']
+  (1, 3)
+  >>> patch,size = get_patch((0.,0.),forest_index)
+  >>> len(patch) == len(get_patch((0.,0.),trees)[0])
+  True
+  """
+  trees = forest[['x','y','r']].values.astype(float)
+  patch_size = (int)(max(forest.r)*(10 + PAD))
+  forest_index = grid_index(trees,patch_cell_size(patch_size))
+  forest_index['trees'] = trees
+  forest_index['patch_size'] = patch_size
+  forest_index['min_r'] = trees[:,2].min()
+  return forest_index
+
+def patch_cell_size(patch_size):
+  """
+  (int) -> float
+
+  Returns the length of the grid cells used to find the patches of half
+  length patch_size. Any positive length is valid, patch_size just keeps
+  queries small.
+  """
+  return float(patch_size) if 0 < patch_size else 1.
+
+def query_forest_index(forest_index,origin,patch_size):
+  """
+  (dict,[double*(2)],int) -> numpy.ndarray
+
+  Returns the sorted row numbers of the trees whose centers fall in the
+  grid cells overlapping the square of half length patch_size about the
+  origin. These are candidates only; get_patch applies the exact test.
+  """
+  x0,y0 = forest_index['origin']
+  nrows,ncols = forest_index['shape']
+  cell_size = forest_index['cell_size']
+  ox,oy = float(origin[0]),float(origin[1])
+  col_lo = max(int(np.floor((ox-patch_size-x0)/cell_size)),0)
+  col_hi = min(int(np.floor((ox+patch_size-x0)/cell_size)),ncols-1)
+  row_lo = max(int(np.floor((oy-patch_size-y0)/cell_size)),0)
+  row_hi = min(int(np.floor((oy+patch_size-y0)/cell_size)),nrows-1)
+  if (col_hi < col_lo or row_hi < row_lo):
+    return np.empty(0,dtype=np.int64)
+
+  # cells of one grid row are contiguous in the sorted cell ids
+  cell_ids = forest_index['cell_ids']
+  rows = []
+  for row in range(row_lo,row_hi+1):
+    lo = np.searchsorted(cell_ids,row*ncols+col_lo,side='left')
+    hi = np.searchsorted(cell_ids,row*ncols+col_hi,side='right')
+    rows.append(forest_index['order'][lo:hi])
+  return np.sort(np.concatenate(rows))
+
 def get_patch(origin,forest):
   """
-  ([double*(2)],pandas.dataframe) -> [pandas.dataframe,int]
+  ([double*(2)],pandas.dataframe or dict) -> [pandas.dataframe or numpy.ndarray,int]
 
   Returns a slice of the forest that is within a square
   neighborhood, described by patch_size*2, about the origin.
   The trees are included in the neighborhood if they entirely
   fall in the boundary of the neighborhood. In other words,
   all the tree's surface is within the square boundary.
+  If forest is an index built by index_forest, then only the trees
+  in nearby grid cells are tested and the patch is returned as an
+  (n,3) numpy array of x,y,r in forest order.
 
   Example:
   (see discretize)
   """
+  if (isinstance(forest,dict)):
+    patch_size = forest['patch_size']
+    candidates = forest['trees'][query_forest_index(forest,origin,patch_size)]
+    return [candidates[in_patch(candidates,origin,patch_size)], patch_size]
+
   patch_size = (int)(max(forest.r)*(10 + PAD))
   l = float(origin[0]-patch_size) < forest.x-forest.r
   r = forest.x+forest.r < float(origin[0]+patch_size)
@@ -51,6 +207,23 @@ def get_patch(origin,forest):
   patch = forest[l & r & u & d]
   return [patch, patch_size]
 
+def in_patch(trees,origin,patch_size):
+  """
+  (numpy.ndarray,[double*(2)],int) -> numpy.ndarray
+
+  Returns whether each tree of an (n,3) array of x,y,r falls entirely in
+  the square of half length patch_size about the origin, the test that
+  get_patch applies. origin may also be an (n,2) array, one per tree.
+  """
+  origin = np.asarray(origin,dtype=float)
+  ox,oy = origin[...,0],origin[...,1]
+  x,y,radius = trees[:,0],trees[:,1],trees[:,2]
+  l = ox-patch_size < x-radius
+  r = x+radius < ox+patch_size
+  u = y+radius < oy+patch_size
+  d = oy-patch_size < y-radius
+  return l & r & u & d
+
 def map_to_mat_idx(tcenter,origin,bsize):
   """
   (numpy.ndarray,numpy.ndarray,int) -> (int,int)
@@ -78,7 +251,7 @@ def map_to_mat_idx(tcenter,origin,bsize):
   """
   # avoid divide by zero or neg
   if (bsize <= 0):
-    print("(!) discretize.map_to_mat_idx: Invalid bsize "+str(bsize))
+    log_limited(logger,logging.ERROR,'bsize',"(!) discretize.map_to_mat_idx: Invalid bsize %s",bsize)
     return (float('NaN'),float('NaN'))
 
   # get deltax, deltay
@@ -93,15 +266,176 @@ def map_to_mat_idx(tcenter,origin,bsize):
 
   return (ii,jj)
 
+def bin_offsets(delta,bsize):
+  """
+  (numpy.ndarray,float) -> numpy.ndarray
+
+  Vectorized form of map_to_mat_idx for one axis. Converts an array of
+  distances into whole blocks by first counting half blocks, exactly as
+  map_to_mat_idx does, so both give the same indices.
+
+  Example:
+  >>> bin_offsets(np.array([0.2,0.6,1.7,-2.2]),1.)
+  array([ 0,  1,  1, -2])
+  """
+  ihalf = np.trunc(2*np.asarray(delta,dtype=float)/bsize).astype(np.int64)
+  return np.where(np.abs(ihalf) < 2, ihalf, np.trunc(ihalf/2).astype(np.int64))
+
+@functools.lru_cache(maxsize=STENCIL_CACHE_SIZE)
+def disk_stencil(binned_radius,binned_radius_root2_by2,bin_size,radius):
+  """
+  (int,int,float,float) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the offsets (rows,cols) of the mat blocks covered by a tree,
+  relative to the block holding the tree center. The stencil starts as a
+  square of side 2*binned_radius+1 and blocks whose distance from the
+  center exceeds the radius are trimmed. Blocks in the inner square,
+  i.e., the square inscribed in the tree, are kept without inspection
+  whenever their row is strictly inside it. The offsets are given in the
+  orientation in which the stencil is stamped into the mat.
+  Stencils are kept in an LRU cache shared by all frames, trials and
+  forests. The key includes the radius itself since trimming compares
+  against it, not its binned value. The returned arrays are read-only;
+  see stencil_cache_info for hit/miss counts.
+
+  Example:
+  >>> rows,cols = disk_stencil(1,0,1.,1.)
+  >>> sorted(zip(rows.tolist(),cols.tolist()))
+  [(-1, 0), (0, -1), (0, 0), (0, 1), (1, 0)]
+  """
+  side = 2*binned_radius + 1
+  row = np.arange(side).reshape(side,1)
+  col = np.arange(side).reshape(1,side)
+  inner_left_edge = binned_radius - binned_radius_root2_by2
+  inner_right_edge = binned_radius + binned_radius_root2_by2
+  # blocks that are never inspected
+  inner = ((inner_left_edge < row) & (row < inner_right_edge)
+    & (inner_left_edge <= col) & (col < inner_right_edge))
+  distance_squared = ((row-binned_radius)*bin_size)**2 + ((col-binned_radius)*bin_size)**2
+  keep = inner | ~(radius**2 < distance_squared)
+  # sub-mask rows run along the mat's columns, so stamp its transpose
+  rows,cols = np.nonzero(keep.T)
+  rows,cols = rows - binned_radius, cols - binned_radius
+  # cached arrays are shared between callers
+  rows.flags.writeable = False
+  cols.flags.writeable = False
+  return (rows,cols)
+
+def stencil_cache_info(reset=False):
+  """
+  (bool) -> functools._CacheInfo
+
+  Returns the hits, misses, maxsize and current size of the disk_stencil
+  cache. If reset is true, then the cache is emptied after reading it.
+
+  Example:
+  >>> rows,cols = disk_stencil(1,0,1.,1.)
+  >>> rows,cols = disk_stencil(1,0,1.,1.)
+  >>> stencil_cache_info(reset=True).hits >= 1
+  True
+  >>> stencil_cache_info().currsize
+  0
+  """
+  info = disk_stencil.cache_info()
+  if (reset):
+    disk_stencil.cache_clear()
+  return info
+
+def count_bins(patch_size,bin_size):
+  """
+  (int,float) -> int
+
+  Returns the side length, in blocks, of a mat that covers a patch of
+  half length patch_size. The length is made odd so that the mat has a
+  center block.
+
+  Example:
+  >>> count_bins(1,0.25)
+  9
+  """
+  n_bins = int(2*patch_size/bin_size)
+  # make sure matrix is oddxodd
+  n_bins += (n_bins+1)%2
+  return n_bins
+
+def bin_trees(point,patch,bin_size,center):
+  """
+  (numpy.ndarray,numpy.ndarray,float,int) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the mat blocks (rows,cols) of the centers of an (n,3) array of
+  trees, binned relative to point, which falls in block (center,center).
+  """
+  [icenter,jcenter] = bin_offsets((patch[:,0]-point[0],patch[:,1]-point[1]),bin_size)
+  return icenter+center,jcenter+center
+
+def stencil_cells(patch,icenter,jcenter,bin_size,owners=False):
+  """
+  (numpy.ndarray,numpy.ndarray,numpy.ndarray,float,bool) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the mat blocks (rows,cols) covered by the stencils of an (n,3)
+  array of trees centered on blocks (icenter,jcenter), without clipping
+  them to the mat. Trees that share a binned radius and radius share one
+  stencil from disk_stencil, which is placed at every one of their
+  centers with a single fancy index. If owners is true, then the patch
+  row of the tree that covers each block is returned as well.
+  """
+  x,radius = patch[:,0],patch[:,2]
+  # convert tree radii to nblocks, measured from the tree center
+  [binned_radius,binned_radius_root2_by2] = bin_offsets(
+    ((x+radius)-x,(x+(2**0.5)*radius/2)-x)
+    ,bin_size)
+
+  # group trees that share a stencil
+  stencils = {}
+  for tree,key in enumerate(zip(binned_radius.tolist()
+    ,binned_radius_root2_by2.tolist()
+    ,radius.tolist())):
+    stencils.setdefault(key,[]).append(tree)
+  rows,cols,trees_of = [],[],[]
+  for key,trees in stencils.items():
+    drows,dcols = disk_stencil(key[0],key[1],bin_size,key[2])
+    rows.append((icenter[trees].reshape(-1,1) + drows).reshape(-1))
+    cols.append((jcenter[trees].reshape(-1,1) + dcols).reshape(-1))
+    trees_of.append(np.repeat(trees,len(drows)))
+  if (owners):
+    return np.concatenate(rows),np.concatenate(cols),np.concatenate(trees_of)
+  return np.concatenate(rows),np.concatenate(cols)
+
+def stamp_trees(mat,point,patch,bin_size,center):
+  """
+  (numpy.ndarray,numpy.ndarray,numpy.ndarray,float,int) -> None
+
+  Bins an (n,3) array of trees relative to point, which falls in block
+  (center,center) of mat, and stamps their stencils into mat. All trees
+  are binned at once (see bin_trees and stencil_cells). Stamps outside of
+  mat are clipped and tree centers are marked with -1.
+  """
+  if (len(patch) == 0):
+    return
+  # get tree centers (block size should be non-zero)
+  icenter,jcenter = bin_trees(point,patch,bin_size,center)
+  rows,cols = stencil_cells(patch,icenter,jcenter,bin_size)
+
+  # apply stencils over tree centers (within boundaries of mat)
+  nrows,ncols = mat.shape
+  inside = (0 <= rows) & (rows < nrows) & (0 <= cols) & (cols < ncols)
+  mat[rows[inside],cols[inside]] = 1
+  # mark tree centers
+  inside = (0 <= icenter) & (icenter < nrows) & (0 <= jcenter) & (jcenter < ncols)
+  mat[icenter[inside],jcenter[inside]] = -1
+  return
+
 def discretize(point,patch,patch_size,minimum_radius):
   """
-  (numpy.ndarray,pandas.dataframe or Series,int,int) -> [numpy.ndarray,int]
+  (numpy.ndarray,pandas.dataframe or Series or numpy.ndarray,int,int) -> [numpy.ndarray,int]
 
   Given a dataframe of trees, quantize the (x,y,r) of the trees and create a
   binary mask that represents trees with ones. The point (x,y) defines the
   center of the mask, which is always odd. The mask and the bin size are
   returned. If the minimum radius is negative or the bin size is too small,
   then [None,-1] is returned.
+  Trees are binned and stamped all at once by stamp_trees. The centers of
+  the moth and trees are marked with -1.
 
   Examples:
   >>> from fileio import load_dataframe
@@ -124,74 +458,271 @@ def discretize(point,patch,patch_size,minimum_radius):
   if(isinstance(patch,pd.DataFrame)
     or isinstance(patch,pd.Series)):
     patch = patch.values
+  patch = np.asarray(patch,dtype=float).reshape(-1,3)
 
   if(minimum_radius < 0):
-    print("(!) discretize.discretize: Negative minimum_radius")
+    logger.error("(!) discretize.discretize: Negative minimum_radius")
     return [None,-1]
   # get block size
   bin_size = minimum_radius/2
 
   # initialize matrix
-  n_bins = int(2*patch_size/bin_size)
-  # make sure matrix is oddxodd and not ridiculously large
-  n_bins += (n_bins+1)%2
+  n_bins = count_bins(patch_size,bin_size)
   if(sys.maxsize < n_bins):
-    print("(!) discretize.discretize: Outrageous mat size, block size is too small")
+    logger.error("(!) discretize.discretize: Outrageous mat size, block size is too small")
     return [None,-1]
 
   # init matrix that hold binary values
   mat = np.zeros((n_bins,n_bins),dtype=int)
+  center = int(n_bins/2)
 
-  # mark moth block bm(0,0)
-  mat[int(n_bins/2)][int(n_bins/2)] = -1
-
-  for tree in patch:
-  # get tree center (block size should be non-zero)
-  binned_tree_loc = map_to_mat_idx(tree,point,bin_size)
-
-  # convert tree radius to nblocks
-  radius = tree[2] # length from center to EDGE of sq = tradius
-  radius_squared = radius**2
-  radius_root2_by2 = (2**0.5)*radius / 2 # length from center to CORNER of sq = tradius
-  [binned_radius,tmp] = map_to_mat_idx((tree[0]+radius,tree[1])
-    ,tree
-    ,bin_size)
-  [binned_radius_root2_by2,tmp] = map_to_mat_idx((tree[0]+radius_root2_by2,tree[1])
-    ,tree
-    ,bin_size)
+  stamp_trees(mat,point,patch,bin_size,center)
 
-  # create a sub-mask of 1's centered on tree (+1 accounts for tree center)
-  l_outter_square = 2*binned_radius + 1
-  l_inner_square = 2*binned_radius_root2_by2 + 1
-  mask = np.ones((l_outter_square,l_outter_square),dtype=int)
-  # trim sub-mask to approximate a circular tree
-  for row in range(0,l_outter_square):
-    offset = l_inner_square - 1
-    inner_left_edge = binned_radius - binned_radius_root2_by2
-    inner_right_edge = binned_radius + binned_radius_root2_by2
-    # inspect all columns if row is not in the inner square, otherwise only
-    # inspect the columns that are in the outter square.
-    if (row <= inner_left_edge or inner_right_edge <= row):
-      offset = 0
-    # inspection: check that distance from center to block is < tree radius
-    for col in range(0, inner_left_edge):
-    if (radius_squared < ((row-binned_radius)*bin_size)**2 + ((col-binned_radius)*bin_size)**2):
-      mask[row][col] = 0
-    for col in range(inner_left_edge + offset,l_outter_square):
-    if (radius_squared < ((row-binned_radius)*bin_size)**2 + ((col-binned_radius)*bin_size)**2):
-      mask[row][col] = 0
-
-  # apply mask over tree center (within boundaries of mat)
-  xmin,xmax = binned_tree_loc[0] - binned_radius + int(n_bins/2), binned_tree_loc[0] + binned_radius + int(n_bins/2)
-  ymin,ymax = binned_tree_loc[1] - binned_radius + int(n_bins/2), binned_tree_loc[1] + binned_radius + int(n_bins/2)
-  mat[xmin:xmax+1].T[ymin:ymax+1] = np.bitwise_or(mat[xmin:xmax+1].T[ymin:ymax+1],mask)
-  # mark tree center
-  icenter = int(n_bins/2)+binned_tree_loc[0];
-  jcenter = int(n_bins/2)+binned_tree_loc[1];
-  mat[icenter][jcenter] = -1
+  # mark moth block bm(0,0)
+  mat[center][center] = -1
 
   return [mat,bin_size]
 
+def mask_key(point,patch,patch_size,minimum_radius):
+  """
+  (numpy.ndarray,numpy.ndarray,int,float) -> tuple
+
+  Returns a key that is the same for two frames whenever discretize would
+  give them the same mask: masks only depend on the trees of the patch and
+  their offsets from the point in whole blocks (see stamp_trees), so a
+  moth that hovers within a block keeps its key. Frames with different
+  keys may still have equal masks, e.g., if a patch lists its trees in
+  another order.
+
+  Example:
+  >>> trees = np.array([[1.,0.,0.1]])
+  >>> mask_key([0.,0.],trees,2,0.1) == mask_key([0.,0.001],trees,2,0.1)
+  True
+  >>> mask_key([0.,0.],trees,2,0.1) == mask_key([0.2,0.],trees,2,0.1)
+  False
+  """
+  patch = np.ascontiguousarray(patch,dtype=float).reshape(-1,3)
+  bin_size = minimum_radius/2
+  icenter = bin_offsets(patch[:,0]-point[0],bin_size)
+  jcenter = bin_offsets(patch[:,1]-point[1],bin_size)
+  return (patch_size,minimum_radius,patch.tobytes(),icenter.tobytes(),jcenter.tobytes())
+
+def rasterize_forest(forest):
+  """
+  (pandas.dataframe or dict) -> dict
+
+  Discretizes a whole forest once into a global grid at the forest's bin
+  size (minimum radius/2) so that the mask of any point can be read out
+  as a window of the grid with get_window. The grid is padded by half a
+  window around the outermost trees and holds 1's for trees and -1's for
+  tree centers as int8. The raster is returned as a dictionary of the
+  grid, the number of stencils on every block ('cover'), the position of
+  block (0,0), the bin size, the window size, and the forest index with
+  the block of every tree's center, which get_window uses to drop the
+  trees that get_patch would drop.
+
+  Windows and discretize use the same trees and stencils, but they are
+  not always equal. discretize bins tree centers relative to the moth and
+  truncates toward it, while the raster bins them on a fixed grid, so a
+  tree may be one block further from the moth. Windows are therefore
+  only used to score approximately (see score.score_trial_fft), never
+  as the masks that generate_trial_masks saves.
+
+  Example:
+  >>> trees = pd.DataFrame([[0.,0.5,0.1],[3.,0.,0.2],[0.2,-0.4,0.1],[-1.9,0.,0.1]],columns=['x','y','r'])
+  >>> raster = rasterize_forest(trees)
+  >>> get_window(raster,(0.,0.)).shape
+  (81, 81)
+  """
+  if (not isinstance(forest,dict)):
+    forest = index_forest(forest)
+  trees = forest['trees']
+  bin_size = forest['min_r']/2
+  n_bins = count_bins(forest['patch_size'],bin_size)
+  center = int(n_bins/2)
+
+  # leave room for half a window, and one block, past the outermost trees
+  # so that every tree is at least a whole block away from block (0,0)
+  reach = trees[:,2].max() + (center+1)*bin_size
+  origin = np.array([trees[:,0].min()-reach,trees[:,1].min()-reach])
+  extent = np.array([trees[:,0].max()+reach,trees[:,1].max()+reach])
+  shape = bin_offsets(extent-origin,bin_size) + 1
+  grid = np.zeros((int(shape[0]),int(shape[1])),dtype=np.int8)
+  stamp_trees(grid,origin,trees,bin_size,0)
+
+  # count stencils per block, so that dropped trees can be taken back out
+  icenter,jcenter = bin_trees(origin,trees,bin_size,0)
+  rows,cols = stencil_cells(trees,icenter,jcenter,bin_size)
+  cells,counts = np.unique(rows*grid.shape[1]+cols,return_counts=True)
+  cover = np.zeros(grid.shape,dtype=np.uint8 if counts.max() < 256 else np.uint16)
+  cover.reshape(-1)[cells] = counts
+
+  return {'grid':grid
+    ,'cover':cover
+    ,'origin':origin
+    ,'bin_size':bin_size
+    ,'n_bins':n_bins
+    ,'forest':forest
+    ,'blocks':np.column_stack((icenter,jcenter))
+    ,'center_cells':np.sort(icenter*grid.shape[1]+jcenter)}
+
+def window_blocks(raster,points):
+  """
+  (dict,numpy.ndarray) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the raster blocks (rows,cols) that hold an (n,2) or wider array
+  of points, i.e., the centers of their windows.
+  """
+  # every tree is a whole block or more from the origin, so trees were
+  # binned by flooring; bin the moth the same way
+  icenter = np.floor((points[:,0]-raster['origin'][0])/raster['bin_size']).astype(np.int64)
+  jcenter = np.floor((points[:,1]-raster['origin'][1])/raster['bin_size']).astype(np.int64)
+  return icenter,jcenter
+
+def window_corrections(raster,points):
+  """
+  (dict,numpy.ndarray) -> scipy.sparse.csr_matrix
+
+  Returns what must be added to the window of each of an (n,2) or wider
+  array of points (see get_window) to get its mask: row i holds, at the
+  flat window block r*n_bins+c, get_window(raster,points[i],copy=True)
+  minus the raster value there. The corrections take out the trees that
+  get_patch drops from a point's patch, i.e., trees that reach into the
+  window but are not entirely in the patch, and mark the moth block by
+  -1. They are found for all points at once, so that the scores of a
+  trajectory can be corrected with one product per kernel (see
+  score.score_trial_fft).
+  """
+  points = np.asarray(points,dtype=float)[:,0:2]
+  forest = raster['forest']
+  trees = forest['trees']
+  grid = raster['grid']
+  bin_size = raster['bin_size']
+  n_bins = raster['n_bins']
+  center = int(n_bins/2)
+  ncols = grid.shape[1]
+  icenter,jcenter = window_blocks(raster,points)
+
+  # stencils reach past their center by at most the largest radius
+  reach = (center+2)*bin_size + trees[:,2].max()
+  pairs,tree_ids = grid_pairs(forest,points,int(np.ceil(reach/forest['cell_size'])))
+  dropped = ~in_patch(trees[tree_ids],points[pairs],forest['patch_size'])
+  pairs,tree_ids = pairs[dropped],tree_ids[dropped]
+  # keep only trees whose stencils may overlap the window
+  binned_radius = bin_offsets(trees[tree_ids,2],bin_size)
+  blocks = raster['blocks'][tree_ids]
+  overlaps = ((np.abs(blocks[:,0]-icenter[pairs]) <= center+binned_radius)
+    & (np.abs(blocks[:,1]-jcenter[pairs]) <= center+binned_radius))
+  pairs,tree_ids = pairs[overlaps],tree_ids[overlaps]
+
+  rows,cols,values = [],[],[]
+  if (len(pairs) > 0):
+    # the stencil and center blocks of every dropped tree, found once
+    dropped_trees,pair_trees = np.unique(tree_ids,return_inverse=True)
+    blocks = raster['blocks'][dropped_trees]
+    srows,scols,owners = stencil_cells(trees[dropped_trees],blocks[:,0],blocks[:,1],bin_size,owners=True)
+    tree_cells = np.concatenate((srows*ncols+scols,blocks[:,0]*ncols+blocks[:,1]))
+    owners = np.concatenate((owners,np.arange(len(dropped_trees))))
+    is_center = np.concatenate((np.zeros(len(srows),dtype=bool),np.ones(len(dropped_trees),dtype=bool)))
+    order = np.argsort(owners,kind='stable')
+    tree_cells,is_center = tree_cells[order],is_center[order]
+    counts = np.bincount(owners,minlength=len(dropped_trees))
+    starts = np.cumsum(counts)-counts
+
+    # expand every (point,tree) pair into the blocks of its tree
+    pair_counts = counts[pair_trees]
+    total = int(pair_counts.sum())
+    steps = np.arange(total) - np.repeat(np.cumsum(pair_counts)-pair_counts,pair_counts)
+    cells = np.repeat(starts[pair_trees],pair_counts) + steps
+    cell_points = np.repeat(pairs,pair_counts)
+    cells,is_center = tree_cells[cells],is_center[cells]
+    # keep the blocks in each point's window, except the moth block
+    wrows = cells//ncols - (icenter[cell_points]-center)
+    wcols = cells%ncols - (jcenter[cell_points]-center)
+    inside = ((0 <= wrows) & (wrows < n_bins) & (0 <= wcols) & (wcols < n_bins)
+      & ~((wrows == center) & (wcols == center)))
+    keys,inverse = np.unique(cell_points[inside]*grid.size + cells[inside],return_inverse=True)
+    is_center = is_center[inside]
+
+    # stencils and tree centers left on each block
+    key_points,key_cells = keys//grid.size,keys%grid.size
+    cover = (raster['cover'].reshape(-1)[key_cells].astype(np.int64)
+      - np.bincount(inverse[~is_center],minlength=len(keys)))
+    center_cells = raster['center_cells']
+    centers = (np.searchsorted(center_cells,key_cells,side='right')
+      - np.searchsorted(center_cells,key_cells,side='left')
+      - np.bincount(inverse[is_center],minlength=len(keys)))
+    mask_values = np.where(0 < centers,-1,(0 < cover).astype(np.int64))
+    rows.append(key_points)
+    cols.append((key_cells//ncols - icenter[key_points] + center)*n_bins
+      + key_cells%ncols - jcenter[key_points] + center)
+    values.append(mask_values - grid.reshape(-1)[key_cells])
+
+  # masks mark the moth block with -1 in place of the raster value, which
+  # is zero past the raster
+  on_grid = ((0 <= icenter) & (icenter < grid.shape[0])
+    & (0 <= jcenter) & (jcenter < grid.shape[1]))
+  moth_values = np.zeros(len(points),dtype=np.int64)
+  moth_values[on_grid] = grid[icenter[on_grid],jcenter[on_grid]]
+  rows.append(np.arange(len(points)))
+  cols.append(np.full(len(points),center*n_bins+center))
+  values.append(-1 - moth_values)
+
+  return csr_matrix((np.concatenate(values),(np.concatenate(rows),np.concatenate(cols)))
+    ,shape=(len(points),n_bins*n_bins))
+
+def get_window(raster,point,copy=False):
+  """
+  (dict,numpy.ndarray,bool) -> numpy.ndarray
+
+  Returns the n_bins x n_bins window of a forest raster centered on the
+  block that holds point. The window is a view into the raster, so it
+  must not be modified; it holds every tree that reaches into it,
+  clipped at its edge, and the moth block is left unmarked. If copy is
+  true, then a new int matrix is returned, just like the mask from
+  discretize: trees that get_patch drops are taken out and the moth
+  block is marked by -1 (see window_corrections). Windows that reach past the raster
+  are always copies, padded with zeros.
+
+  Example:
+  >>> trees = pd.DataFrame([[0.5,0.,0.1],[0.,0.98,0.1]],columns=['x','y','r'])
+  >>> raster = rasterize_forest(trees)
+  >>> point = np.array([0.,0.01])
+  >>> patch,size = get_patch(point,raster['forest'])
+  >>> len(patch)
+  1
+  >>> int((get_window(raster,point) != 0).sum()) > int((get_window(raster,point,copy=True) != 0).sum())
+  True
+  >>> window = get_window(raster,point,copy=True)
+  >>> int((window != 0).sum()) == int((discretize(point,patch,size,0.1)[0] != 0).sum())
+  True
+  """
+  if(isinstance(point,pd.Series)):
+    point = point.values
+  grid = raster['grid']
+  n_bins = raster['n_bins']
+  center = int(n_bins/2)
+  point = np.asarray(point,dtype=float).reshape(1,-1)
+  icenter,jcenter = window_blocks(raster,point)
+  imin,jmin = int(icenter[0])-center,int(jcenter[0])-center
+  imax,jmax = imin+n_bins,jmin+n_bins
+
+  if (0 <= imin and imax <= grid.shape[0] and 0 <= jmin and jmax <= grid.shape[1]):
+    window = grid[imin:imax,jmin:jmax]
+  else:
+    window = np.zeros((n_bins,n_bins),dtype=grid.dtype)
+    # copy the part of the window that overlaps the raster
+    gi0,gi1 = max(imin,0),min(imax,grid.shape[0])
+    gj0,gj1 = max(jmin,0),min(jmax,grid.shape[1])
+    if (gi0 < gi1 and gj0 < gj1):
+      window[gi0-imin:gi1-imin,gj0-jmin:gj1-jmin] = grid[gi0:gi1,gj0:gj1]
+
+  if (copy):
+    window = window.astype(int)
+    corrections = window_corrections(raster,point)
+    window.reshape(-1)[corrections.indices] += corrections.data
+  return window
+
 """ DOC TESTS """
 if __name__ == "__main__":
   import doctest
@@ -1,6 +1,13 @@
 #!/usr/bin/python3
 
-def get_trajs(data,conditions):
+import numpy as np
+import pandas as pd
+from logs import get_logger
+from fileio import CONDITION_COLUMNS
+
+logger = get_logger('extractTrajs')
+
+def get_trajs(data,conditions,split_on_datetime=False):
   """
   Retrieves a set of single trajectories as sclices from a Pandas DataFrame.
 
@@ -20,6 +27,9 @@ def get_trajs(data,conditions):
    - fog_min (float)
    - fog_max (float)
    These values should match the ones used for the set of trials returned.
+  split_on_datetime : bool, optional
+   Also start a new trial wherever the 'datetime' column changes (see
+   segment_trials). By default, this is False.
 
   Returns
   -------
@@ -37,52 +47,127 @@ def get_trajs(data,conditions):
   e.g., trial = data[trial_dictionary['f0'][0]:trial_dictionary['f0'][1]]
 
   """
-  print(conditions)
+  logger.debug("conditions: %s",conditions)
   obst,speed,fmin,fmax,mid = conditions[0],conditions[1],conditions[2],conditions[3],conditions[4]
+  selected = sel_speed(data,speed) & sel_fmin(data,fmin) & sel_fmax(data,fmax) & sel_moth(data,mid)
   if('obstacles' in data.columns):
-    obs_slice = data[sel_obstacle(data,obst)]
-  else:
-    obs_slice = data.copy(False)
-
-  moth_slice = obs_slice[sel_speed(data,speed)
-      & sel_fmin(data,fmin)
-      & sel_fmax(data,fmax)
-      & sel_moth(data,mid)]
+    selected &= sel_obstacle(data,obst)
+  moth_slice = data[selected]
 
   if(len(moth_slice) == 0):
-    print("(!) ERROR: Problem getting moth chunk")
+    logger.error("(!) ERROR: Problem getting moth chunk for %s",conditions)
     return moth_slice
 
-  # extract no. trials
-  dictionary = {}
-  trial_count = 0
+  # find the first and one-past-last index of every trial at once
+  datetimes = moth_slice['datetime'].values if split_on_datetime else None
+  starts,ends = segment_trials(moth_slice.index.values,datetimes)
   flight = 'f'
-  iprev = moth_slice.index[0]
-  start_new = False
-  # fill in the first trial's starting index
-  dictionary[flight+str(trial_count)] = [iprev,0]
+  dictionary = {flight+str(trial_count): [start,end]
+    for trial_count,(start,end) in enumerate(zip(starts.tolist(),ends.tolist()))}
 
-  for icurr in moth_slice.index[1:]:
-    if (icurr - iprev) > 1:
-      # mark the end of the current trial at iprev+1
-      dictionary[flight+str(trial_count)][1] = iprev+1
-      print("flight"+str(trial_count)+" : "+str(icurr)+" - "+str(iprev))
+  # verify extraction by checking length
+  tlen = int((ends - starts).sum())
+  assert tlen == len(moth_slice), "Total trial length doens't match length of moth slice."
+
+  return dictionary
 
-      # mark the start of the next trial at icurr
-      trial_count += 1
-      dictionary[flight+str(trial_count)] = [icurr,0]
-    iprev = icurr
+def segment_trials(index,datetimes=None):
+  """
+  Finds the trials in a sorted run of row indices.
 
-  # don't forget last index
-  dictionary[flight+str(trial_count)][1] = moth_slice.index[-1]+1
+  A new trial starts wherever the index jumps by more than one, and, if
+  datetimes are given, wherever the datetime changes between rows.
 
-  # verify extraction by checking length
-  tlen=0
-  for el in dictionary.values():
-     tlen += len(data[el[0]:el[1]])
-  assert tlen != len(moth_slice), "Total trial length doens't match length of moth slice."
+  Parameters
+  ----------
+  index : array_like
+   Sorted integer row indices, e.g., the index of a slice of moth data.
+  datetimes : array_like, optional
+   The datetime of each row.
 
-  return dictionary
+  Returns
+  -------
+  starts, ends : numpy.ndarray
+   The first index of each trial and one past its last index, i.e., the
+   ranges of get_trajs.
+
+  Examples
+  --------
+  >>> segment_trials([3,4,5,9,10])
+  (array([3, 9]), array([ 6, 11]))
+  >>> segment_trials([3,4,5,6],datetimes=['a','a','b','b'])
+  (array([3, 5]), array([5, 7]))
+  """
+  index = np.asarray(index)
+  if(len(index) == 0):
+    return index[:0],index[:0]
+  breaks = np.diff(index) > 1
+  if(datetimes is not None):
+    datetimes = np.asarray(datetimes)
+    breaks |= datetimes[1:] != datetimes[:-1]
+  first = np.concatenate(([0],np.flatnonzero(breaks)+1))
+  last = np.concatenate((first[1:]-1,[len(index)-1]))
+  return index[first],index[last]+1
+
+def segment_groups(data,columns=CONDITION_COLUMNS,split_on_datetime=True):
+  """
+  Finds the trials of every condition group of the moth data in one pass.
+
+  Rows are grouped by the values in `columns` and each group is split
+  into trials as in segment_trials. Trials are numbered from zero within
+  their group, in index order, like the keys of get_trajs. Rows with a
+  missing (NaN) value in any of `columns` belong to no group and are
+  dropped, as in groupby.
+
+  Parameters
+  ----------
+  data : Pandas.DataFrame
+   A collection of multiple trajectories with the condition columns and,
+   if split_on_datetime, a 'datetime' column.
+  columns : array_like, optional
+   The condition columns to group by. Missing columns are ignored. By
+   default, these are CONDITION_COLUMNS.
+  split_on_datetime : bool, optional
+   Also start a new trial wherever the datetime changes. By default,
+   this is True.
+
+  Returns
+  -------
+  trials : Pandas.DataFrame
+   One row per trial with the condition columns, the trial number
+   ('trial'), its index range ('start','end'), its length ('length') and,
+   if split_on_datetime, its 'datetime'. It is empty, with these
+   columns, if no row has all of its condition values.
+  """
+  columns = [c for c in columns if c in data.columns]
+  trial_columns = columns+['trial','start','end','length']+(['datetime'] if split_on_datetime else [])
+  if(len(data) == 0):
+    return pd.DataFrame(columns=trial_columns)
+  codes = data.groupby(columns,sort=False).ngroup().values
+  index = data.index.values
+  # rows with a missing condition are numbered -1; leave them out
+  keep = np.flatnonzero(codes >= 0)
+  if(len(keep) == 0):
+    return pd.DataFrame(columns=trial_columns)
+  # bring each group's rows together in index order
+  order = keep[np.lexsort((index[keep],codes[keep]))]
+  codes,index = codes[order],index[order]
+
+  breaks = (np.diff(codes) != 0) | (np.diff(index) > 1)
+  if(split_on_datetime):
+    datetimes = data['datetime'].values[order]
+    breaks |= datetimes[1:] != datetimes[:-1]
+  first = np.concatenate(([0],np.flatnonzero(breaks)+1))
+  last = np.concatenate((first[1:]-1,[len(index)-1]))
+
+  trials = data.iloc[order[first]][columns].reset_index(drop=True)
+  trials['trial'] = trials.groupby(columns,sort=False).cumcount().values
+  trials['start'] = index[first]
+  trials['end'] = index[last]+1
+  trials['length'] = last-first+1
+  if(split_on_datetime):
+    trials['datetime'] = datetimes[first]
+  return trials
 
 def sel_moth(block,name):
   return block.moth_id == name
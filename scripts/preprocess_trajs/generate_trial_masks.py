@@ -1,52 +1,242 @@
 #!/usr/bin/python3
 
 import numpy as np
-from fileio import load_dataframe
+from fileio import load_dataframe, load_forest_batch, forest_from_batch, TRAJ_COLUMNS
 import discretize
+import mask_store
+import artifact_cache
+import instrument
+import logging
+from logs import get_logger, log_limited
+from trial_catalog import update_catalog, select_trials
 import pickle
 import glob
 import os
 
-def discretize_and_save(trial_hash,forest,traj,trial_id,trial_datetime):
+logger = get_logger('generate_trial_masks')
+
+# fields of a discretized trial; one packed frame per element
+TRIAL_DTYPE = np.dtype([('mat','O')
+  ,('x', '<f4'), ('y', '<f4')
+  ,('hx', '<f4'), ('hy', '<f4')])
+
+def discretize_trial(forest,traj,trial_id,dedup=True):
   """
-  (dict,pandas.dataframe,pandas.dataframe,str,trial_datetime) -> None
+  (pandas.dataframe or dict,pandas.dataframe,str,bool) -> [numpy.ndarray,float]
 
   Generates a set of discretized frames for a given trajectory and forest.
   It is expected that traj is a dataframe of x,y,headingx,headingy data.
   For each point, a sparse matrix is computed that describes the forest
   environment near it. This point is packed, with its corresponding frame,
-  into an array. This array is stored in the dictionary, trial_hash, using
-  the key trial_id/datetime.
+  into an array. The array and the bin size of its frames are returned.
+  The forest may be given as a dataframe or as an index from
+  discretize.index_forest; pass the index when processing many trials.
+  trial_id only labels warnings.
+  If dedup is true, then a frame whose mask key (discretize.mask_key)
+  was already seen in the trial is not discretized again: it
+  refers to the earlier frame's sparse matrix, which pickles once. Masks
+  are the same as without dedup.
+  Each stage is timed, and frames, trees per patch, mask sizes and reused
+  masks are counted, when instrument is enabled.
+
+  Example:
+  >>> trees = load_dataframe("csv","test/trees.csv")
+  loading: test/trees.csv
+  >>> traj = load_dataframe("h5","test/moth1_448f0.h5")[TRAJ_COLUMNS]
+  loading: test/moth1_448f0.h5
+  >>> [frames,bsize] = discretize_trial(trees,traj,'moth1_448f0')
+  >>> [copies,copies_bsize] = discretize_trial(trees,traj,'moth1_448f0',dedup=False)
+  >>> len(frames) == len(copies) == len(traj) and bool(bsize == copies_bsize)
+  True
+  >>> len(set(id(mat) for mat in frames['mat'])) < len(frames)
+  True
+  >>> all((a != b).nnz == 0 for a,b in zip(frames['mat'],copies['mat']))
+  True
+  >>> all(np.array_equal(frames[f],copies[f]) for f in ['x','y','hx','hy'])
+  True
   """
   pt_cnt = 0
   bsize = 0
+  # patches are looked up through a grid index of the forest
+  if (not isinstance(forest,dict)):
+    forest = discretize.index_forest(forest)
+  min_radius = forest['min_r']
   # array of mat,data pairs
-  trial = np.zeros(len(traj),dtype=[('mat','O')
-    ,('x', '<f4'), ('y', '<f4')
-    ,('hx', '<f4'), ('hy', '<f4')])
+  trial = np.zeros(len(traj),dtype=TRIAL_DTYPE)
+  # frame number of the first mask with each key
+  first_frames = {}
   # process other points from
   for point in traj.values:
     xy = point[0:2] #
     # get scoring region, may contain trees
+    t0 = instrument.start()
     [patch,sz] = discretize.get_patch(xy,forest)
-    # discretize that shit
-    [mask, bsize_temp] = discretize.discretize(xy,patch,sz,min(forest.r))
+    instrument.stop('get_patch',t0)
+    instrument.count('trees_per_patch',len(patch))
+    key = discretize.mask_key(xy,patch,sz,min_radius) if dedup else None
+    if (key not in first_frames):
+      # discretize that shit
+      t0 = instrument.start()
+      [mask, bsize_temp] = discretize.discretize(xy,patch,sz,min_radius)
+      instrument.stop('discretize',t0)
+    if (key in first_frames):
+      # same mask as an earlier frame; refer to its sparse matrix
+      first = first_frames[key]
+      trial[pt_cnt] = (trial['mat'][first],point[0],point[1],point[2],point[3])
+      instrument.count('masks_reused')
+      pt_cnt += 1
+      continue
     bsize = max(bsize_temp,bsize)
     # save mask, trial count, and block size
     if (0 < bsize_temp):
+      t0 = instrument.start()
       discretize.pack(mask,point,pt_cnt,trial)
+      instrument.stop('pack',t0)
+      instrument.count('mask_bins',mask.size)
+      if (key is not None):
+        first_frames[key] = pt_cnt
     else:
-      print("generate_trail_masks.processTrial: WARN: failed to compute mask for "+trial_id+"["+str(pt_cnt)+"]")
+      log_limited(logger,logging.WARNING,'failed_mask'
+        ,"generate_trail_masks.processTrial: WARN: failed to compute mask for %s[%d]",trial_id,pt_cnt)
 
     pt_cnt += 1
 
-  trial_hash[trial_id+'_'+str(trial_datetime)] = [trial,bsize]
+  instrument.count('frames',pt_cnt)
+  return [trial,bsize]
+
+def save_trial(trial_hash,trial,trial_id,trial_datetime):
+  """
+  (dict,[numpy.ndarray,float],str,trial_datetime) -> None
+
+  Stores a discretized trial, i.e., [array of frames, bin size], in the
+  dictionary, trial_hash, using the key trial_id/datetime.
+  """
+  trial_hash[trial_id+'_'+str(trial_datetime)] = trial
+
+  logger.info("%s",trial_id)
+  logger.info("len: %d",len(trial[0]))
+
+  return
+
+def discretize_and_save(trial_hash,forest,traj,trial_id,trial_datetime):
+  """
+  (dict,pandas.dataframe or dict,pandas.dataframe,str,trial_datetime) -> None
+
+  Discretizes a trajectory with discretize_trial and stores the array of
+  frames in the dictionary, trial_hash, using the key trial_id/datetime.
+  """
+  t0 = instrument.start()
+  trial = discretize_trial(forest,traj,trial_id)
+  instrument.stop('discretize_and_save',t0)
+  save_trial(trial_hash,trial,trial_id,trial_datetime)
+  instrument.count('trials')
+  return
+
+def load_and_discretize(trial_path,forest_index,cache=None):
+  """
+  (str,dict,dict) -> [dict,[numpy.ndarray,float]]
+
+  Loads a single trial file and discretizes its trajectory. Returns a
+  description of the trial (moth_id, conditions, length and datetime)
+  with the discretized trial, or [None,None] if no data was loaded.
+  processTrials runs this for each trial, possibly in worker processes.
+  If a cache (see forest_cache) is given, then a trial whose trajectory
+  was already discretized with the same forest and parameters is read
+  from it instead.
+  """
+  t0 = instrument.start()
+  raw_data = load_dataframe("h5",trial_path)
+  instrument.stop('load_hdf',t0)
+  logger.info("Processing points: %d",len(raw_data.values))
+  # skip processing if dataframe is empty
+  if(len(raw_data) == 0):
+    return [None,None]
+
+  # get a description of conditions
+  # i.e., desc = 'flightspeed_fogmin_fogmax'
+  info = {'moth_id':raw_data.moth_id.iloc[0]
+    ,'desc':str(int(raw_data.flight_speed.iloc[0]))+'_'+\
+      str(int(raw_data.fog_min.iloc[0]))+'_'+\
+      str(int(raw_data.fog_max.iloc[0]))
+    ,'length':len(raw_data.values)
+    ,'datetime':raw_data.datetime.iloc[0]}
+
+  # process x,y,hx,hy slice of raw data into discretized frames
+  traj = raw_data[TRAJ_COLUMNS]
+  if (cache is None):
+    t0 = instrument.start()
+    trial = discretize_trial(forest_index,traj,trial_path.split('/')[-1])
+    instrument.stop('load_and_discretize',t0)
+    return [info,trial]
+
+  t0 = instrument.start()
+  key = artifact_cache.cache_key(cache['forest_key'],artifact_cache.hash_arrays(traj.values))
+  trial = artifact_cache.cache_get(cache['dir'],key)
+  instrument.stop('cache_get',t0)
+  if (trial is None):
+    t0 = instrument.start()
+    trial = discretize_trial(forest_index,traj,trial_path.split('/')[-1])
+    instrument.stop('load_and_discretize',t0)
+    t0 = instrument.start()
+    artifact_cache.cache_put(cache['dir'],key,trial,cache['max_bytes'])
+    instrument.stop('cache_put',t0)
+  else:
+    logger.info("cached: %s",trial_path)
+    instrument.count('cache_hits')
+  return [info,trial]
+
+def forest_cache(cache_dir,forest_index,max_bytes=None):
+  """
+  (str,dict,int) -> dict
+
+  Describes a mask cache for one forest: its directory, size limit and
+  the part of every key that identifies the forest's trees, the mask
+  parameters (discretize.mask_params).
+  An existing cache is trimmed to max_bytes right away.
+  """
+  if (max_bytes is not None and os.path.isdir(cache_dir)):
+    artifact_cache.evict_cache(cache_dir,max_bytes)
+  params = discretize.mask_params()
+  forest_key = artifact_cache.cache_key(artifact_cache.hash_arrays(forest_index['trees'])
+    ,artifact_cache.hash_params(params))
+  return {'dir': cache_dir, 'max_bytes': max_bytes, 'forest_key': forest_key}
+
+# forest index and mask cache shared by the worker processes of processTrials
+worker_forest = {}
 
-  print(trial_id)
-  print("len: "+str(len(trial)))
+def init_worker(forest_index,cache=None,instrumented=False):
+  """
+  (dict,dict,bool) -> None
 
+  Stores the forest index and mask cache in a worker process once,
+  so that they are not sent along with every trial. If instrumented, then
+  the worker collects timers and counters too.
+  """
+  worker_forest['index'] = forest_index
+  worker_forest['cache'] = cache
+  worker_forest['stencil_cache'] = discretize.stencil_cache_info()
+  if (instrumented):
+    instrument.enable("worker")
   return
 
+def load_and_discretize_in_worker(trial_path):
+  """
+  (str) -> [dict,[numpy.ndarray,float]]
+
+  Runs load_and_discretize with the forest given to init_worker. The
+  worker's stencil cache hits and misses for this trial are sent back as
+  info['stencil_cache'] and, if the worker is instrumented, what it
+  collected as info['instrument'].
+  """
+  [info,trial] = load_and_discretize(trial_path,worker_forest['index'],worker_forest['cache'])
+  if (info is not None):
+    before = worker_forest['stencil_cache']
+    after = worker_forest['stencil_cache'] = discretize.stencil_cache_info()
+    info['stencil_cache'] = {'hits': after.hits-before.hits, 'misses': after.misses-before.misses}
+  if (info is not None and instrument.enabled()):
+    info['instrument'] = instrument.take()
+  return [info,trial]
+
 def writeToFile(file_name,txt):
   """
   (str,str) -> None
@@ -57,15 +247,50 @@ def writeToFile(file_name,txt):
   file_name.write(bytes(txt+'\n','UTF-8'))
   return
 
-def processTrials(batch_o_trials,forest,filepath_prefix,logfile):
+def processTrials(batch_o_trials,forest,filepath_prefix,logfile,workers=1,store_path=None
+  ,cache_dir=None,cache_bytes=None):
   """
-  (array of str,pandas.dataframe,str,str) -> None
+  (array of str,pandas.dataframe,str,str,int,str,str,int) -> dict
 
   Loads a data frame from each file path in the list and transforms it
   into an array of discretized frames. These frames are saved into a
   dictionary of the corresponding mothid. The dictionary of trials is
   saved into a pickle labeled with the trial conditions.
-
+  If workers is more than 1, then trials are discretized independently by
+  a pool of that many processes. Results are gathered in the order of
+  batch_o_trials, so the log and pickles match a serial run. The hits and
+  misses of the stencil cache (see discretize.stencil_cache_info), summed
+  over this process and the workers, are returned.
+  If store_path is given, then every trial is also written to a columnar
+  mask store there (see mask_store), which can be memory mapped for scoring.
+  If cache_dir is given, then discretized trials are cached there, keyed
+  by the trajectory, forest and mask parameters, so a re-run only computes
+  new trials or forests. The cache is kept under cache_bytes, if given, by
+  evicting the least recently used trials.
+  When instrument is enabled, loading, each discretization stage, caching
+  and pickling are timed, and trials, frames, trees per patch, mask sizes
+  and bytes written are counted, including those of worker processes.
+
+  Example:
+  >>> import tempfile
+  >>> from logs import configure
+  >>> _ = configure(levels={'fileio':'WARNING','generate_trial_masks':'WARNING'})
+  >>> trees = load_dataframe("csv","test/trees.csv")
+  >>> trials = ["test/moth1_448f0.h5"]*3
+  >>> out = tempfile.TemporaryDirectory()
+  >>> with open(out.name+"/log","wb") as log:
+  ...   _ = processTrials(trials,trees,out.name+"/serial",log)
+  ...   _ = processTrials(trials,trees,out.name+"/pool",log,workers=3)
+  >>> def load_pickle(path):
+  ...   with open(path+"/moth1/4_4_8.pickle","rb") as handle:
+  ...     return pickle.load(handle)
+  >>> serial,pool = load_pickle(out.name+"/serial"),load_pickle(out.name+"/pool")
+  >>> len(serial),sorted(serial) == sorted(pool)
+  (3, True)
+  >>> all((a != b).nnz == 0 for key in serial for a,b in zip(serial[key][0]['mat'],pool[key][0]['mat']))
+  True
+  >>> out.cleanup()
+  >>> _ = configure(levels={'fileio':'INFO','generate_trial_masks':'INFO'})
 
   >>> import os
   >>> dump = os.getcwd()+"/test"
@@ -106,83 +331,146 @@ def processTrials(batch_o_trials,forest,filepath_prefix,logfile):
   # initialize trial dictionary
   # key = trialid_datetime, val = [trial,block_size]
   trial_hash = {}
+  store = mask_store.new_mask_store() if store_path is not None else None
+  # index the forest once for all trials
+  t0 = instrument.start()
+  forest_index = discretize.index_forest(forest)
+  instrument.stop('index_forest',t0)
+  cache = None
+  if (cache_dir is not None):
+    cache = forest_cache(cache_dir,forest_index,cache_bytes)
 
   """ PROCESS EACH TRIAL INTO STACK OF MASKS """
-  for st in batch_o_trials:
-    raw_data = load_dataframe("h5",st)
-    print( "Processing points: "+str(len(raw_data.values)) )
-    # skip processing if dataframe is empty
-    if(len(raw_data) == 0):
-      print("(!) generate_trail_masks.processTrials: No moth data loaded for "+st)
-      continue
-
-    new_moth = raw_data.moth_id.iloc[0]
-    # get a description of conditions
-    desc = str(int(raw_data.flight_speed.iloc[0]))+'_'+\
-     str(int(raw_data.fog_min.iloc[0]))+'_'+\
-     str(int(raw_data.fog_max.iloc[0]))
-
-    # setup a directory (named after mothid) to store pickle files
-    filepath = filepath_prefix+'/'+new_moth
-    if not os.path.exists(filepath):
-      os.makedirs(filepath)
-
-    # We save a group of trials into a pickle file for each mothid
-    # This condition only occurs when the mothid changes (i.e., the
-    # previous set of trials is saved).
-    if (mothname != "" and mothname != new_moth):
-      print(mothname+": saving "+str(trial_cnt)+" trajs in "+filepath+'/'+desc+".pickle")
-      with open(filepath+'/'+desc+'.pickle', 'wb') as handle:
-       pickle.dump(trial_hash, handle)
-      # reset count and dictionary!
-      trial_cnt = 0
-      trial_hash = {}
-
-    # record the mothid, trial count, and trial length in a log file
-    # --(!) Logging must be done after we determine whether this set
-    # of trials is for a new moth.
-    if (trial_cnt == 0):
-      writeToFile(logfile,str(new_moth)+":")
-    # log trial length
-    writeToFile(logfile,"\tt"+str(trial_cnt)+" = "+str(len(raw_data.values)))
-
-    # process x,y,hx,hy slice of raw data into the dictionary of discretized frames
-    traj = raw_data[['pos_x','pos_y','head_x', 'head_y']]
-    trial_datetime = raw_data.datetime.iloc[0]
-    discretize_and_save(trial_hash,forest,traj,'t'+str(trial_cnt),trial_datetime)
-    # update the current mothid
-    mothname = new_moth
-    # update trial count
-    trial_cnt += 1
+  # stencil cache hits and misses of this process and of the workers
+  stencil_start = discretize.stencil_cache_info()
+  stencil_cache = {'hits': 0, 'misses': 0}
+  pool = None
+  if (1 < workers):
+    import multiprocessing
+    pool = multiprocessing.Pool(workers,initializer=init_worker,initargs=(forest_index,cache,instrument.enabled()))
+    # imap yields results in the order of the trials
+    results = pool.imap(load_and_discretize_in_worker,batch_o_trials)
+  else:
+    results = (load_and_discretize(st,forest_index,cache) for st in batch_o_trials)
+
+  # the workers are stopped at once if saving a trial fails
+  try:
+    for st,[info,trial] in zip(batch_o_trials,results):
+      # skip processing if dataframe is empty
+      if(info is None):
+        logger.warning("(!) generate_trail_masks.processTrials: No moth data loaded for %s",st)
+        continue
+      instrument.merge(info.pop('instrument',None))
+      for stat,value in info.pop('stencil_cache',{}).items():
+        stencil_cache[stat] += value
+      instrument.count('trials')
+
+      new_moth = info['moth_id']
+
+      # We save a group of trials into a pickle file for each mothid
+      # This condition only occurs when the mothid changes (i.e., the
+      # previous set of trials is saved). filepath and desc still
+      # describe the previous moth here.
+      if (mothname != "" and mothname != new_moth):
+        logger.info("%s: saving %d trajs in %s/%s.pickle",mothname,trial_cnt,filepath,desc)
+        t0 = instrument.start()
+        with open(filepath+'/'+desc+'.pickle', 'wb') as handle:
+         pickle.dump(trial_hash, handle)
+         instrument.count('bytes_written',handle.tell())
+        instrument.stop('pickle',t0)
+        # reset count and dictionary!
+        trial_cnt = 0
+        trial_hash = {}
+
+      # get a description of conditions
+      desc = info['desc']
+
+      # setup a directory (named after mothid) to store pickle files
+      filepath = filepath_prefix+'/'+new_moth
+      if not os.path.exists(filepath):
+        os.makedirs(filepath)
+
+      # record the mothid, trial count, and trial length in a log file
+      # --(!) Logging must be done after we determine whether this set
+      # of trials is for a new moth.
+      if (trial_cnt == 0):
+        writeToFile(logfile,str(new_moth)+":")
+      # log trial length
+      writeToFile(logfile,"\tt"+str(trial_cnt)+" = "+str(info['length']))
+
+      # store the discretized frames in the dictionary of trials
+      save_trial(trial_hash,trial,'t'+str(trial_cnt),info['datetime'])
+      if (store is not None):
+        t0 = instrument.start()
+        mask_store.add_trial(store,new_moth,desc,'t'+str(trial_cnt)+'_'+str(info['datetime']),trial[0],trial[1])
+        instrument.stop('mask_store_add',t0)
+      # update the current mothid
+      mothname = new_moth
+      # update trial count
+      trial_cnt += 1
+  except BaseException:
+    if (pool is not None):
+      pool.terminate()
+      pool.join()
+    raise
+  if (pool is not None):
+    pool.close()
+    pool.join()
 
   # save the last trial into trial dictionary
-  print(mothname+": saving "+str(trial_cnt)+" trajs in "+filepath+'/'+desc+".pickle")
+  logger.info("%s: saving %d trajs in %s/%s.pickle",mothname,trial_cnt,filepath,desc)
+  t0 = instrument.start()
   with open(filepath+'/'+desc+'.pickle', 'wb') as handle:
     pickle.dump(trial_hash, handle)
-
-  return
+    instrument.count('bytes_written',handle.tell())
+  instrument.stop('pickle',t0)
+  if (store is not None):
+    logger.info("saving %d trajs in %s",len(store['trials']),store_path)
+    t0 = instrument.start()
+    mask_store.save_mask_store(store,store_path)
+    instrument.stop('save_mask_store',t0)
+
+  stencil_end = discretize.stencil_cache_info()
+  stencil_cache['hits'] += stencil_end.hits-stencil_start.hits
+  stencil_cache['misses'] += stencil_end.misses-stencil_start.misses
+  return stencil_cache
 
 def main():
   DATA_LOC = "../data/masks/original_set"
   FOREST_LOC = "../data/forests/forest.csv"
+  TRIALS_LOC = "/home/bilkit/Dropbox/moth_nav_analysis/data/single_trials"
+  CONDITIONS = None # e.g., {'moth_id':'moth1','flight_speed':4.0}
+  WORKERS = 1 # >1 computes masks in a process pool
+  CACHE_LOC = "../data/masks/cache" # discretized trials of every forest
+  CACHE_BYTES = 20*2**30
+  INSTRUMENT = False # time stages and count frames, saved in DATA_LOC/run_report.json
   import sys
-  # if a new forest path is specified, then save masks as a random set
-  if (len(sys.argv) == 2):
+  FOREST_INDEX = None
+  # if a new forest path is specified, then save masks as a random set;
+  # a forest batch (see randomForests.createForestBatch) also needs the
+  # index of the forest in it
+  if (len(sys.argv) == 2 or len(sys.argv) == 3):
     FOREST_LOC = sys.argv[1]
     DATA_LOC = DATA_LOC.replace('original_set','random_sets')
     DATA_LOC += "/"+FOREST_LOC.split('/')[-1]
+    if (len(sys.argv) == 3):
+      FOREST_INDEX = int(sys.argv[2])
+      DATA_LOC += "_"+str(FOREST_INDEX)
     # make sure directory exists for saving data
     if not os.path.exists(DATA_LOC):
       os.makedirs(DATA_LOC)
 
   """ LOAD & INITIALIZE DATA """
   # read tree data
-  forest = load_dataframe("csv",FOREST_LOC)
-  print( "Forest size: "+str(len(forest.values)) )
+  if (FOREST_INDEX is None):
+    forest = load_dataframe("csv",FOREST_LOC)
+  else:
+    forest = forest_from_batch(load_forest_batch(FOREST_LOC),FOREST_INDEX)
+  logger.info("Forest size: %d",len(forest.values))
 
   # terminate early if forest data is empty
   if(len(forest) == 0):
-    print("(!) generate_trail_masks.main: No tree data loaded.")
+    logger.error("(!) generate_trail_masks.main: No tree data loaded.")
     return
 
   # prepare to log processed trials in Notes file and record datetime
@@ -194,22 +482,40 @@ def main():
   writeToFile(LOG,str(datetime.datetime.fromtimestamp(time.time())))
 
   # gather single trial data stored in hdf format
-  single_trials = glob.glob("/home/bilkit/Dropbox/moth_nav_analysis/data/single_trials/*.h5")
+  single_trials = glob.glob(TRIALS_LOC+"/*.h5")
+  # catalog the trials (only new or modified files are opened) and keep
+  # the ones with the wanted conditions
+  catalog = update_catalog(TRIALS_LOC+"/catalog",single_trials)
+  single_trials = select_trials(catalog,CONDITIONS)['source'].unique().tolist()
   if (len(single_trials) < 1):
-    print("No trials to process.\n~~Done.")
+    logger.info("No trials to process.\n~~Done.")
     return
   single_trials.sort()
-  print("Computing masks for:")
-  # print file names that will be processed
-  for t in single_trials: print('\t'+t+'\n')
+  logger.info("Computing masks for:")
+  # log file names that will be processed
+  for t in single_trials: logger.info("\t%s\n",t)
   # start processing trial data
-  processTrials(single_trials,forest,DATA_LOC,LOG)
+  if (INSTRUMENT):
+    instrument.enable(DATA_LOC)
+  stencil_cache = processTrials(single_trials,forest,DATA_LOC,LOG,workers=WORKERS,store_path=DATA_LOC+"/mask_store"
+    ,cache_dir=CACHE_LOC,cache_bytes=CACHE_BYTES)
+
+  # report how often tree stencils were reused across frames and trials
+  stencil_summary = "Stencil cache: {:d} hits, {:d} misses".format(
+    stencil_cache['hits'],stencil_cache['misses'])
+  logger.info("%s",stencil_summary)
+  writeToFile(LOG,stencil_summary)
+  if (INSTRUMENT):
+    instrument.write_report(DATA_LOC+"/run_report.json")
+    run_summary = instrument.summary(instrument.disable())
+    logger.info("%s",run_summary)
+    writeToFile(LOG,run_summary)
 
   # cleanup files
   LOG.close()
 
 
-  print("~~Done :)")
+  logger.info("~~Done :)")
   return
 
 if __name__ == "__main__":
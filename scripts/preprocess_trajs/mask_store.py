@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+import numpy as np
+from logs import get_logger
+import pickle
+import glob
+import os
+
+logger = get_logger('mask_store')
+
+# a store is a directory of .npy files so that every column can be memory
+# mapped; frame f of the store owns indices/values[offsets[f]:offsets[f+1]]
+STORE_FILES = ['trials','offsets','indices','values','poses']
+# one row per trial; start/stop index the store's frames. The string
+# fields are sized to the longest moth, desc and key when a store is saved
+# (see trial_dtype), so these are only their minimum lengths
+STORE_TRIAL_DTYPE = np.dtype([('moth','U16'),('desc','U32'),('key','U64')
+  ,('start','<i8'),('stop','<i8')
+  ,('bin_size','<f8'),('n_bins','<i4')])
+# rows of the poses column
+POSE_FIELDS = ['x','y','hx','hy']
+
+def new_mask_store():
+  """
+  () -> dict
+
+  Returns an empty, in-memory mask store to be filled with add_trial and
+  written with save_mask_store.
+  """
+  return {'trials': [], 'offsets': [np.zeros(1,dtype=np.int64)]
+    ,'indices': [], 'values': [], 'poses': [], 'n_frames': 0}
+
+def add_trial(store,moth_id,desc,trial_key,trial,bin_size):
+  """
+  (dict,str,str,str,numpy.ndarray,float) -> bool
+
+  Appends a trial packed by generate_trial_masks.discretize_trial to an
+  in-memory store. Each mask is kept as the flat (row-major) indices and
+  values of its nonzero cells, so a frame costs 5 bytes per tree cell
+  instead of a pickled bsr_matrix. Every trial in a store must have the
+  same mask size; if not, nothing is added and False is returned.
+  """
+  masks = trial['mat']
+  n_bins = masks[0].shape[0]
+  if (len(store['trials']) > 0 and store['trials'][0][-1] != n_bins):
+    logger.error("(!) mask_store.add_trial: %s has %dx%d masks but the store has %dx%d."
+      ,trial_key,n_bins,n_bins,store['trials'][0][-1],store['trials'][0][-1])
+    return False
+
+  counts = np.zeros(len(masks),dtype=np.int64)
+  for iframe,mat in enumerate(masks):
+    coo = mat.tocoo()
+    keep = coo.data != 0
+    flat = coo.row[keep].astype(np.int32)*n_bins + coo.col[keep]
+    order = np.argsort(flat)
+    store['indices'].append(flat[order])
+    store['values'].append(coo.data[keep][order].astype(np.int8))
+    counts[iframe] = len(flat)
+  store['offsets'].append(store['offsets'][-1][-1] + np.cumsum(counts))
+  store['poses'].append(np.stack([trial[field] for field in POSE_FIELDS]).astype('<f4'))
+
+  start = store['n_frames']
+  store['n_frames'] += len(masks)
+  store['trials'].append((moth_id,desc,trial_key,start,store['n_frames'],bin_size,n_bins))
+  return True
+
+def trial_dtype(trials):
+  """
+  (list) -> numpy.dtype
+
+  Returns STORE_TRIAL_DTYPE with its string fields widened to hold the
+  longest moth id, desc and key of a list of trial rows, so none is
+  truncated.
+
+  Example:
+  >>> trial_dtype([('moth1','4_4_8','t0_'+'9'*70,0,10,0.1,111)])['key']
+  dtype('<U73')
+  """
+  fields = []
+  for ifield,name in enumerate(STORE_TRIAL_DTYPE.names):
+    dtype = STORE_TRIAL_DTYPE[name]
+    if (dtype.kind == 'U'):
+      longest = max([len(str(row[ifield])) for row in trials],default=0)
+      dtype = np.dtype('U'+str(max(dtype.itemsize//4,longest)))
+    fields.append((name,dtype))
+  return np.dtype(fields)
+
+def save_mask_store(store,store_path):
+  """
+  (dict,str) -> None
+
+  Writes an in-memory store as a directory of .npy files, replacing any
+  store already at store_path.
+  """
+  if not os.path.exists(store_path):
+    os.makedirs(store_path)
+  columns = {'trials': np.array(store['trials'],dtype=trial_dtype(store['trials']))
+    ,'offsets': np.concatenate(store['offsets'])
+    ,'indices': np.concatenate(store['indices']) if store['indices'] else np.zeros(0,dtype=np.int32)
+    ,'values': np.concatenate(store['values']) if store['values'] else np.zeros(0,dtype=np.int8)
+    ,'poses': np.concatenate(store['poses'],axis=1) if store['poses'] else np.zeros((4,0),dtype='<f4')}
+  for name in STORE_FILES:
+    np.save(store_path+'/'+name+'.npy',columns[name])
+
+def load_mask_store(store_path,mmap_mode='r'):
+  """
+  (str,str) -> dict
+
+  Opens a store written by save_mask_store. By default, every column is
+  memory mapped, so only the frames that are read are paged in. Pass
+  mmap_mode=None to load the columns into memory instead.
+  """
+  if(not os.path.isfile(store_path+'/trials.npy')):
+    raise FileNotFoundError("(!) ERROR: {:s} is not a mask store.".format(store_path))
+  store = {}
+  for name in STORE_FILES:
+    store[name] = np.load(store_path+'/'+name+'.npy',mmap_mode=mmap_mode)
+  return store
+
+def find_trials(store,moth_id=None,desc=None):
+  """
+  (dict,str,str) -> numpy.ndarray
+
+  Returns the row numbers, in the store's trials table, of the trials of
+  a moth and/or condition description. By default, all trials match.
+  """
+  trials = store['trials']
+  match = np.ones(len(trials),dtype=bool)
+  if (moth_id is not None):
+    match &= trials['moth'] == moth_id
+  if (desc is not None):
+    match &= trials['desc'] == desc
+  return np.flatnonzero(match)
+
+def trial_frames(store,itrial):
+  """
+  (dict,int) -> (int,int)
+
+  Returns the [start,stop) frame range of a trial in the store.
+  """
+  row = store['trials'][itrial]
+  return int(row['start']), int(row['stop'])
+
+def read_masks(store,start,stop,out=None):
+  """
+  (dict,int,int,numpy.ndarray) -> numpy.ndarray
+
+  Densifies frames [start,stop) of a store into a float (frames,N,N)
+  stack, like score.stack_masks does for pickled masks. Only the payload
+  of those frames is read. A buffer may be passed as out so that chunks
+  can reuse it; only its first stop-start frames are used.
+  """
+  n_bins = int(store['trials']['n_bins'][0])
+  nframes = stop - start
+  if (out is None):
+    out = np.zeros((nframes,n_bins,n_bins),dtype=float)
+  else:
+    out = out[:nframes]
+    out.fill(0)
+  offsets = np.asarray(store['offsets'][start:stop+1])
+  indices = store['indices'][offsets[0]:offsets[-1]]
+  values = store['values'][offsets[0]:offsets[-1]]
+  frames = np.repeat(np.arange(nframes),np.diff(offsets))
+  out.reshape(nframes,n_bins*n_bins)[frames,indices] = values
+  return out
+
+def read_poses(store,start,stop):
+  """
+  (dict,int,int) -> dict
+
+  Returns the x, y, hx and hy columns of frames [start,stop) of a store.
+  """
+  poses = store['poses']
+  return {field: np.asarray(poses[irow,start:stop]) for irow,field in enumerate(POSE_FIELDS)}
+
+def pickles_to_mask_store(filepath_prefix,store_path):
+  """
+  (str,str) -> int
+
+  Converts the per-moth pickles written by generate_trial_masks.processTrials
+  under filepath_prefix (i.e., <moth>/<conditions>.pickle) into one store
+  at store_path. Trials are added in sorted moth, condition and key order.
+  Returns the number of trials converted.
+  """
+  store = new_mask_store()
+  pickle_files = glob.glob(filepath_prefix+'/*/*.pickle')
+  pickle_files.sort()
+  for pickle_file in pickle_files:
+    moth_id = pickle_file.split('/')[-2]
+    desc = pickle_file.split('/')[-1].split('.')[0]
+    with open(pickle_file,'rb') as handle:
+      trial_hash = pickle.load(handle)
+    for trial_key in sorted(trial_hash.keys()):
+      trial,bsize = trial_hash[trial_key]
+      add_trial(store,moth_id,desc,trial_key,trial,bsize)
+  save_mask_store(store,store_path)
+  return len(store['trials'])
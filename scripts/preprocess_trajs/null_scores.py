@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+"""
+Scores one trial against a batch of random forests (see
+randomForests.createForestBatch) to build an empirical null distribution
+of its score, and compares the score in the real forest with it.
+
+Forests of a batch share the seed forest's tree radii, so the patch size,
+bin size, kernels and a grid index of the trajectory's points are
+computed once per trial (prepare_trial). Each forest then only has to
+find, for each tree, the frames whose patch holds it; frames without
+trees all have the same mask, so only frames with trees are discretized.
+Scores are the same as score.score_trial_kernels gives for the trial's
+masks from generate_trial_masks.discretize_trial, to within float
+round-off.
+"""
+
+import numpy as np
+import discretize
+from logs import get_logger
+from fileio import load_forest_batch, TRAJ_COLUMNS
+from score import generateKernelMatrix, score_masks_kernels
+
+logger = get_logger('null_scores')
+
+def prepare_trial(traj,forest,kernel_param_sets):
+  """
+  (pandas.dataframe or numpy.ndarray,pandas.dataframe or dict,array_like) -> dict
+
+  Computes everything about a trial that does not depend on where trees
+  are: its points, the patch and bin sizes of forests with the given
+  forest's tree radii, the K kernels (rotated by the first heading, as in
+  score.score_trial_kernels), the score of a frame with no trees, and a
+  grid index of the points with cells one patch long.
+  """
+  if (hasattr(traj,'columns')):
+    traj = traj[TRAJ_COLUMNS]
+  points = np.asarray(traj.values if hasattr(traj,'values') else traj,dtype=float)
+  if (not isinstance(forest,dict)):
+    forest = discretize.index_forest(forest)
+  patch_size = forest['patch_size']
+  min_r = forest['min_r']
+
+  # a frame with no trees only marks the moth
+  [empty,bsize] = discretize.discretize(points[0,0:2],np.empty((0,3)),patch_size,min_r)
+  N = empty.shape[0]
+
+  prep = {'points':points
+    ,'patch_size':patch_size
+    ,'min_r':min_r
+    ,'max_r':forest['trees'][:,2].max()
+    ,'n_bins':N
+    ,'empty_mask':empty
+    # index the points on a grid so that the frames near a tree are
+    # found by looking at the 3x3 cells about it
+    ,'grid':discretize.grid_index(points[:,0:2],discretize.patch_cell_size(patch_size))}
+  prep['kernels'],prep['empty_scores'] = trial_kernels(prep,kernel_param_sets)
+  return prep
+
+def trial_kernels(prep,kernel_param_sets):
+  """
+  (dict,array_like) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the (K,N*N) kernels of a prepared trial for K parameter sets,
+  rotated by its first heading, and the (K,) scores of a frame with no
+  trees. Searches over kernels call this for each candidate and reuse
+  the rest of the preparation.
+  """
+  points = prep['points']
+  # trials keep headings as <f4 (see generate_trial_masks.TRIAL_DTYPE)
+  kernels = generateKernelMatrix([prep['n_bins'],np.float32(points[0,2]),np.float32(points[0,3])]
+    ,kernel_param_sets
+    ,rotate=True)
+  if (kernels is None):
+    return None,None
+  empty_scores = score_masks_kernels(prep['empty_mask'][np.newaxis].astype(float),kernels)[:,0]
+  return kernels,empty_scores
+
+def tree_frame_pairs(prep,trees):
+  """
+  (dict,numpy.ndarray) -> (numpy.ndarray,numpy.ndarray)
+
+  Returns the frame and tree numbers of every pair where the tree is in
+  the frame's patch, by the same test as discretize.get_patch. Pairs are
+  sorted by frame, then tree.
+  """
+  tree_ids,frames = discretize.grid_pairs(prep['grid'],trees[:,0:2])
+  # keep trees that entirely fall in the patch, as get_patch does
+  keep = discretize.in_patch(trees[tree_ids],prep['points'][frames,0:2],prep['patch_size'])
+  frames,tree_ids = frames[keep],tree_ids[keep]
+  order = np.lexsort((tree_ids,frames))
+  return frames[order],tree_ids[order]
+
+def forest_masks(prep,trees):
+  """
+  (dict,numpy.ndarray) -> dict
+
+  Discretizes the frames of a prepared trial that have trees in their
+  patch, for a forest given as an (n,3) array of x,y,r trees. Every other
+  frame has the prepared empty mask. Masks are kept sparse: 'frames'
+  lists the frames with trees and frame i owns the flat 'cells' and
+  int8 'values' in [offsets[i],offsets[i+1]). Masks can be scored against
+  many kernels with score_forest_masks without discretizing again. If the
+  trees do not have the radii bounds of the prepared forest (to within
+  float round-off), then None is returned.
+  """
+  trees = np.asarray(trees,dtype=float)
+  if (not np.isclose(trees[:,2].min(),prep['min_r']) or not np.isclose(trees[:,2].max(),prep['max_r'])):
+    logger.error("(!) null_scores.forest_masks: Tree radii [%g,%g] differ from the prepared forest's [%g,%g]."
+      ,trees[:,2].min(),trees[:,2].max(),prep['min_r'],prep['max_r'])
+    return None
+  points = prep['points']
+  frames,tree_ids = tree_frame_pairs(prep,trees)
+  tree_frames,first = np.unique(frames,return_index=True)
+  last = np.append(first[1:],len(frames))
+  cells,values = [],[]
+  for iframe,frame in enumerate(tree_frames.tolist()):
+    patch = trees[tree_ids[first[iframe]:last[iframe]]]
+    [mat,bsize] = discretize.discretize(points[frame,0:2],patch,prep['patch_size'],prep['min_r'])
+    mat = mat.reshape(-1)
+    frame_cells = np.flatnonzero(mat)
+    cells.append(frame_cells.astype(np.int32))
+    values.append(mat[frame_cells].astype(np.int8))
+  counts = np.array([len(c) for c in cells],dtype=np.int64)
+  return {'frames':tree_frames
+    ,'offsets':np.concatenate(([0],np.cumsum(counts)))
+    ,'cells':np.concatenate(cells) if cells else np.empty(0,dtype=np.int32)
+    ,'values':np.concatenate(values) if values else np.empty(0,dtype=np.int8)}
+
+def score_forest_masks(prep,masks,kernels=None,empty_scores=None):
+  """
+  (dict,dict,numpy.ndarray,numpy.ndarray) -> numpy.ndarray
+
+  Returns the (K,frames) scores of masks from forest_masks. By default,
+  the prepared kernels are used; others may be given with their empty
+  frame scores (see trial_kernels). Only nonzero cells are visited.
+  """
+  if (kernels is None):
+    kernels,empty_scores = prep['kernels'],prep['empty_scores']
+  N = prep['n_bins']
+  scores = np.repeat(empty_scores[:,np.newaxis],len(prep['points']),axis=1)
+  if (len(masks['frames']) > 0):
+    # every mask marks the moth, so no frame owns an empty run of cells
+    weighted = kernels[:,masks['cells']]*masks['values']
+    scores[:,masks['frames']] = np.add.reduceat(weighted,masks['offsets'][:-1],axis=1)/N/N
+  return scores
+
+def score_forest(prep,trees):
+  """
+  (dict,numpy.ndarray) -> numpy.ndarray
+
+  Returns the (K,frames) scores of a prepared trial in a forest given as
+  an (n,3) array of x,y,r trees, or None if the trees do not have the
+  radii bounds of the prepared forest.
+
+  Example:
+  >>> from fileio import load_dataframe
+  >>> from generate_trial_masks import discretize_trial
+  >>> from score import score_trial_kernels
+  >>> trees = load_dataframe("csv","test/trees.csv")
+  loading: test/trees.csv
+  >>> traj = load_dataframe("h5","test/moth1_448f0.h5")
+  loading: test/moth1_448f0.h5
+  >>> kernel_param_sets = [[[(-2,0),(2,0)],[(2,1),(2,1)],[1,2]],[[(0,3)],[(1,1)],[1]]]
+  >>> prep = prepare_trial(traj,trees,kernel_param_sets)
+  >>> scores = score_forest(prep,trees[['x','y','r']].values)
+  >>> stored = score_trial_kernels(discretize_trial(trees,traj[TRAJ_COLUMNS],'moth1_448f0'),kernel_param_sets)
+  >>> scores.shape
+  (2, 3454)
+  >>> np.allclose(scores,stored,rtol=0,atol=1e-15)
+  True
+  """
+  masks = forest_masks(prep,trees)
+  if (masks is None):
+    return None
+  return score_forest_masks(prep,masks)
+
+def trial_statistic(scores):
+  """
+  (numpy.ndarray) -> numpy.ndarray
+
+  Reduces (K,frames) scores to one statistic per kernel: the mean score.
+  """
+  return scores.mean(axis=1)
+
+def p_values(observed,null,alternative='two-sided'):
+  """
+  (numpy.ndarray,numpy.ndarray,str) -> numpy.ndarray
+
+  Returns the empirical p-value of each observed statistic (K,) given a
+  (forests,K) null distribution. alternative is 'greater', 'less' or
+  'two-sided'. The observed value counts as one draw, so p > 0.
+
+  >>> p_values(np.array([3.]),np.array([[1.],[2.],[4.]]),'greater')
+  array([0.5])
+  """
+  n = len(null)
+  greater = (1 + (null >= observed).sum(axis=0))/(n+1)
+  less = (1 + (null <= observed).sum(axis=0))/(n+1)
+  if (alternative == 'greater'):
+    return greater
+  if (alternative == 'less'):
+    return less
+  return np.minimum(1.,2*np.minimum(greater,less))
+
+# prepared trial and forest batch shared by the worker processes
+worker_null = {}
+
+def init_worker(prep,batch_path):
+  """
+  (dict,str) -> None
+
+  Stores the prepared trial in a worker process and memory maps the
+  forest batch there, so neither is sent along with every forest.
+  """
+  worker_null['prep'] = prep
+  worker_null['batch'] = load_forest_batch(batch_path)
+
+def score_batch_forest(index):
+  """
+  (int) -> numpy.ndarray
+
+  Returns the statistic of the worker's trial in forest number index of
+  its batch. Raises a ValueError if the forest's radii bounds differ from
+  those of the real forest, since its masks would have another size.
+  """
+  forest = worker_null['batch'][index]
+  scores = score_forest(worker_null['prep'],np.array(forest['trees']))
+  if (scores is None):
+    raise ValueError("(!) ERROR: the tree radii of forest {} (index {:d}) differ from the real forest's."
+      .format(forest['id'],index))
+  return trial_statistic(scores)
+
+def null_distribution(traj,forest,batch_path,kernel_param_sets,forest_indices=None
+  ,workers=1,alternative='two-sided'):
+  """
+  (pandas.dataframe,pandas.dataframe,str,array_like,array_like,int,str) -> dict
+
+  Scores a trajectory in the real forest and in the forests of a batch
+  file, and returns the observed statistic per kernel ('observed', (K,)),
+  the null distribution ('null', (forests,K)), the ids of the forests
+  used ('ids') and the p-values ('p_value', (K,)). By default, every
+  forest of the batch is used. Every forest must have the real forest's
+  smallest and largest radii (see score_batch_forest). With workers > 1, forests are scored by a
+  pool of that many processes.
+  """
+  if (not isinstance(forest,dict)):
+    forest = discretize.index_forest(forest)
+  prep = prepare_trial(traj,forest,kernel_param_sets)
+  observed = trial_statistic(score_forest(prep,forest['trees']))
+
+  batch = load_forest_batch(batch_path)
+  if (forest_indices is None):
+    forest_indices = np.arange(len(batch))
+  forest_indices = np.asarray(forest_indices)
+
+  if (1 < workers):
+    import multiprocessing
+    with multiprocessing.Pool(workers,initializer=init_worker,initargs=(prep,batch_path)) as pool:
+      chunksize = max(1,len(forest_indices)//(4*workers))
+      null = np.array(pool.map(score_batch_forest,forest_indices.tolist(),chunksize=chunksize))
+  else:
+    init_worker(prep,batch_path)
+    null = np.array([score_batch_forest(index) for index in forest_indices.tolist()])
+
+  return {'observed':observed
+    ,'null':null
+    ,'ids':np.asarray(batch['id'][forest_indices])
+    ,'p_value':p_values(observed,null,alternative)}
+
+""" DOC TESTS """
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
@@ -17,9 +17,13 @@ given, then no work is done and a usage error is uttered.
 
 import sys
 import os.path as osp
-from fileio import load_dataframe
+from fileio import save_dataframe, convert_to_table, select_table
 from extractTrajs import get_trajs
 
+# bulk moth data and its queryable copy (see fileio.convert_to_table)
+BULK_DATA = "/media/usb/Input/moth_data.h5"
+BULK_TABLE = "/media/usb/Input/moth_table.h5"
+
 def main():
    argc = len(sys.argv)
    if(argc == 2):
@@ -32,27 +36,37 @@ def main():
    if(path_to_data[end] == '/'):
       path_to_data = path_to_data[:end]
 
-   print("Please specify the moth and trial conditions you want to save:")
-   mid = input("'moth_id': ")
-   obs = input("'obstacle': ")
-   speed = float(input("'flight_speed': "))
-   fmin = float(input("'fog_min': "))
-   fmax = float(input("'fog_max': "))
+   # copy the moth data into an indexed table once, so that each set of
+   # conditions only reads its own rows
+   if(not osp.isfile(BULK_TABLE)):
+      print("indexing: "+BULK_DATA)
+      convert_to_table(BULK_DATA,BULK_TABLE)
 
-   # read moth data
-   dmoth = load_dataframe("h5","/media/usb/Input/moth_data.h5")
+   print("Please specify the moth and trial conditions you want to save (no moth_id to stop):")
+   while(True):
+      mid = input("'moth_id': ")
+      if(mid == ""):
+         break
+      obs = input("'obstacle': ")
+      speed = float(input("'flight_speed': "))
+      fmin = float(input("'fog_min': "))
+      fmax = float(input("'fog_max': "))
 
-   # extract trials
-   trajs = get_trajs(dmoth,obs,speed,fmin,fmax,mid)
-   if(len(trajs) == 0):
-      print("(!) ERROR: can't save trajs")
-      return
+      # read moth data of these conditions
+      dmoth = select_table(BULK_TABLE,{'moth_id':mid,'obstacles':obs
+         ,'flight_speed':speed,'fog_min':fmin,'fog_max':fmax})
+
+      # extract trials
+      trajs = get_trajs(dmoth,[obs,speed,fmin,fmax,mid])
+      if(len(trajs) == 0):
+         print("(!) ERROR: can't save trajs")
+         continue
 
-   # save trials
-   verbose_name = mid+'_'+str(int(speed))+str(int(fmin))+str(int(fmax))
-   for ff in trajs:
-      tt = dmoth[trajs[ff][0]:trajs[ff][1]]
-      save_dataframe(tt,'h5',path_to_data+'/'+verbose_name+ff+".h5")
+      # save trials; trial ranges are labels of the bulk data's index
+      verbose_name = mid+'_'+str(int(speed))+str(int(fmin))+str(int(fmax))
+      for ff in trajs:
+         tt = dmoth.loc[trajs[ff][0]:trajs[ff][1]-1]
+         save_dataframe(tt,'h5',path_to_data+'/'+verbose_name+ff+".h5")
    return
 
 if (__name__ == "__main__"):
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+"""
+Scores a trial straight from its trajectory file. Points are read from
+the hdf trial in chunks, each point is turned into a patch and a mask,
+and masks are scored against a set of kernels a window at a time, so no
+more than `window` masks are ever held and nothing is written to disk.
+The stages are generators and can be used on their own.
+"""
+
+import numpy as np
+import pandas as pd
+import logging
+import discretize
+from fileio import TRAJ_COLUMNS
+from score import generateKernelMatrix, score_masks_kernels
+from logs import get_logger, log_limited
+
+logger = get_logger('stream_scores')
+
+def stream_points(trial_path,chunksize=4096):
+  """
+  (str,int) -> iterator of numpy.ndarray
+
+  Yields the x,y,hx,hy of each point of a trial file, reading a table
+  format file (e.g., from fileio.save_dataframe) chunksize rows at a time.
+  As in fileio.load_dataframe, the key is the filename sans extension.
+  """
+  key = trial_path.split('/')[-1].split('.')[0]
+  with pd.HDFStore(trial_path,mode='r') as store:
+    if (store.get_storer(key).is_table):
+      chunks = store.select(key,columns=TRAJ_COLUMNS,chunksize=chunksize)
+    else:
+      chunks = [store.select(key)[TRAJ_COLUMNS]]
+    for chunk in chunks:
+      for point in chunk[TRAJ_COLUMNS].values:
+        yield point
+
+def stream_masks(points,forest):
+  """
+  (iterator,pandas.dataframe or dict) -> iterator of (numpy.ndarray,numpy.ndarray,float)
+
+  Yields each point with its dense mask and bin size, computed as
+  generate_trial_masks.discretize_trial does: with get_patch and
+  discretize.
+  """
+  if (not isinstance(forest,dict)):
+    forest = discretize.index_forest(forest)
+  for point in points:
+    [patch,size] = discretize.get_patch(point[0:2],forest)
+    [mat,bsize] = discretize.discretize(point[0:2],patch,size,forest['min_r'])
+    yield point,mat,bsize
+
+def stream_scores(masks,kernel_param_sets,window=1024,mask_sink=None):
+  """
+  (iterator,array_like,int,callable) -> iterator of numpy.ndarray
+
+  Scores masks from stream_masks against K kernels and yields a (K,n)
+  array of scores for each window of n <= window masks. The kernels are
+  rotated by the heading of the first point, as in
+  score.score_trial_kernels. If mask_sink is given, then it is called
+  with every (point,mask,bsize) before the mask is dropped, e.g., to keep
+  masks for debugging. A point whose mask could not be computed (None)
+  is scored as an empty frame, 0, as generate_trial_masks.discretize_trial
+  leaves it.
+  """
+  kernels = None
+  chunk = None
+  n = 0
+  for ipoint,(point,mat,bsize) in enumerate(masks):
+    if (mask_sink is not None):
+      mask_sink(point,mat,bsize)
+    if (mat is None):
+      log_limited(logger,logging.WARNING,'failed_mask'
+        ,"stream_scores.stream_scores: WARN: failed to compute mask for point %d",ipoint)
+      if (chunk is None):
+        # no mask size yet, so nothing is buffered; score the frame alone
+        yield np.zeros((len(kernel_param_sets),1))
+        continue
+      mat = 0
+    elif (kernels is None):
+      N = mat.shape[0]
+      # the headings are cast to <f4 only so that scores are bit-for-bit
+      # equal to those of stored trials, which keep headings as <f4
+      kernels = generateKernelMatrix([N,np.float32(point[2]),np.float32(point[3])]
+        ,kernel_param_sets
+        ,rotate=True)
+      if (kernels is None):
+        return
+      chunk = np.empty((window,N,N),dtype=float)
+    chunk[n] = mat
+    n += 1
+    if (n == window):
+      yield score_masks_kernels(chunk,kernels)
+      n = 0
+  if (n > 0):
+    yield score_masks_kernels(chunk[:n],kernels)
+
+def score_trial_stream(trial_path,forest,kernel_param_sets,window=1024,mask_sink=None):
+  """
+  (str,pandas.dataframe or dict,array_like,int,callable) -> numpy.ndarray
+
+  Returns the (K,frames) scores of a trial file against K kernels,
+  computed in one streaming pass (see stream_points, stream_masks and
+  stream_scores). The result equals score.score_trial_kernels applied to
+  the trial's stored masks.
+
+  Example:
+  >>> from fileio import load_dataframe
+  >>> from generate_trial_masks import discretize_trial
+  >>> from score import score_trial_kernels
+  >>> trees = load_dataframe("csv","test/trees.csv")
+  loading: test/trees.csv
+  >>> traj = load_dataframe("h5","test/moth1_448f0.h5")
+  loading: test/moth1_448f0.h5
+  >>> kernel_param_sets = [[[(-2,0),(2,0)],[(2,1),(2,1)],[1,2]],[[(0,3)],[(1,1)],[1]]]
+  >>> stored = score_trial_kernels(discretize_trial(trees,traj[TRAJ_COLUMNS],'moth1_448f0'),kernel_param_sets)
+  >>> streamed = score_trial_stream("test/moth1_448f0.h5",trees,kernel_param_sets,window=1000)
+  >>> streamed.shape
+  (2, 3454)
+  >>> np.array_equal(streamed,stored)
+  True
+  """
+  points = stream_points(trial_path)
+  masks = stream_masks(points,forest)
+  scores = list(stream_scores(masks,kernel_param_sets,window,mask_sink))
+  if (len(scores) == 0):
+    return np.zeros((len(kernel_param_sets),0))
+  return np.concatenate(scores,axis=1)
+
+""" DOC TESTS """
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
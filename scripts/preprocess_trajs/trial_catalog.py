@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+A small table of every trial the pipeline knows about, so that trials can
+be listed and selected by their conditions without opening their files.
+Each row holds a trial's source file (and its modification time), its
+number within that file, its conditions, datetime, length and the range
+of bulk-data row indices it came from. The catalog is saved as hdf and
+updated incrementally: only new or modified files are read.
+"""
+
+import numpy as np
+import pandas as pd
+import os
+from fileio import load_dataframe, CONDITION_COLUMNS
+from extractTrajs import segment_groups
+
+CATALOG_KEY = "catalog"
+CATALOG_COLUMNS = ['source','mtime','trial'] + CONDITION_COLUMNS + ['datetime','length','start','end']
+
+def empty_catalog():
+  """
+  () -> pandas.dataframe
+
+  Returns a catalog with no trials.
+  """
+  return pd.DataFrame({c: [] for c in CATALOG_COLUMNS})
+
+def catalog_trial_file(trial_path,mtime=None):
+  """
+  (str,float) -> pandas.dataframe
+
+  Reads a trial file (e.g., one saved by saveSingleTrials) and returns
+  the catalog rows of the trials in it, found with
+  extractTrajs.segment_groups.
+  """
+  data = load_dataframe("h5",trial_path)
+  if (data is None or len(data) == 0):
+    return empty_catalog()
+  rows = segment_groups(data)
+  rows.insert(0,'source',trial_path)
+  rows.insert(1,'mtime',os.path.getmtime(trial_path) if mtime is None else mtime)
+  return rows.reindex(columns=CATALOG_COLUMNS)
+
+def load_catalog(catalog_path):
+  """
+  (str) -> pandas.dataframe
+
+  Loads a saved catalog, or returns an empty one if there is none yet.
+  """
+  if (not os.path.isfile(catalog_path)):
+    return empty_catalog()
+  return pd.read_hdf(catalog_path,CATALOG_KEY)
+
+def update_catalog(catalog_path,trial_paths):
+  """
+  (str,array of str) -> pandas.dataframe
+
+  Brings the catalog at catalog_path up to date with the given trial
+  files and saves it. Files already cataloged with the same modification
+  time are not opened; new or modified files are (re)read, and rows of
+  files that no longer exist are dropped. Returns the updated catalog,
+  sorted by source file and trial number.
+  """
+  catalog = load_catalog(catalog_path)
+  mtimes = {path: os.path.getmtime(path) for path in trial_paths}
+  known = dict(zip(catalog['source'],catalog['mtime']))
+  stale = [path for path in trial_paths if known.get(path) != mtimes[path]]
+
+  keep = ~catalog['source'].isin(stale) & np.array([os.path.isfile(p) for p in catalog['source']],dtype=bool)
+  if (len(stale) == 0 and keep.all()):
+    return catalog
+  parts = [catalog[keep]] + [catalog_trial_file(path,mtimes[path]) for path in stale]
+  parts = [part for part in parts if len(part) > 0]
+  catalog = pd.concat(parts,ignore_index=True) if parts else empty_catalog()
+  catalog = catalog.sort_values(['source','trial'],kind='stable').reset_index(drop=True)
+  catalog.to_hdf(catalog_path,key=CATALOG_KEY,mode='w')
+  return catalog
+
+def select_trials(catalog,conditions=None,min_length=0):
+  """
+  (pandas.dataframe,dict,int) -> pandas.dataframe
+
+  Returns the catalog rows whose columns match every column:value pair
+  of conditions, e.g., {'moth_id':'moth1','flight_speed':4.0}, and that
+  have at least min_length frames.
+
+  >>> catalog = pd.DataFrame({'moth_id':['moth1','moth2'],'length':[10,20]})
+  >>> select_trials(catalog,{'moth_id':'moth2'})['length'].tolist()
+  [20]
+  """
+  match = np.array(catalog['length'] >= min_length,dtype=bool)
+  if (conditions is not None):
+    for column,value in conditions.items():
+      match &= np.asarray(catalog[column] == value)
+  return catalog[match]
@@ -1,10 +1,12 @@
 #!/usr/bin/python3
 
-from fileio import load_dataframe, save_dataframe
+from fileio import load_dataframe, save_dataframe, forest_batch_dtype, save_forest_batch
 from plotStuff import plot_trees
+from logs import get_logger
 import numpy as np
 import math
 
+logger = get_logger('randomForests')
 
 FOREST_PATH = "../data/forests/"
 
@@ -24,30 +26,71 @@ def createNForests(N,src_filepath=FOREST_PATH+"forest.csv",dst_filepath=FOREST_P
 
   # compute mean and standard deviation of this distance
   mean_radius, sig_radius = computeNormalStats(seed_radii)
-  print("seed forest:\nmean = {:2f}\n sig = {:2f}".format(mean_radius,sig_radius))
+  logger.info("seed forest:\nmean = %2f\n sig = %2f",mean_radius,sig_radius)
 
   # generate and save new forests
   import time, datetime, re
   non_digit_chars = re.compile("\D")
   for iforest in range(N):
-    print("processing forest: {0:d}".format(iforest))
+    logger.info("processing forest: %d",iforest)
     new_forest = seed_forest.copy()
     newForest(new_forest,mean_radius,sig_radius)
     # useful for debug
     new_radii = (new_forest['x']**2 + new_forest['y']**2)**0.5
     new_mean, new_sig = computeNormalStats(new_radii)
-    print("mean = {:2f}\n sig = {:2f}".format(new_mean,new_sig))
+    logger.info("mean = %2f\n sig = %2f",new_mean,new_sig)
 
     # obtain datetime from timestamp then create label, yr_mo_dy_hr_min_sec
     datetime_from_timestamp = datetime.datetime.fromtimestamp(time.time())
     # # we only need precision up to whole seconds
     # label = datetime_from_timestamp.split('.')[0]
-    label = non_digit_chars.sub('_',str(datetime_from_timestamp))
+    # forests made within the same clock tick get the same datetime, so
+    # the forest count is part of the label too
+    label = non_digit_chars.sub('_',str(datetime_from_timestamp))+"_"+str(iforest)
     # save tree data as cvs with timestamp/datetime label
     save_dataframe(new_forest,'csv',dst_filepath+"forest_"+label+".csv")
-    print("saved @ "+dst_filepath+"forest_"+label+".csv")
+    logger.info("saved @ %sforest_%s.csv",dst_filepath,label)
   return
 
+def createForestBatch(N,src_filepath=FOREST_PATH+"forest.csv",dst_filepath=None,seed=None,first_id=0):
+  """
+  (int,str,str,int,int) -> numpy.ndarray
+
+  Given a source file path to the seed forest, create N forests as one
+  batch, i.e., a record array (see fileio.forest_batch_dtype) whose
+  'trees' field is an (N,trees,3) array of x,y,r. Tree positions are
+  drawn as in newForest. Each forest is drawn by its own generator,
+  seeded from seed, and its seed and id (first_id onward) are stored
+  with it, so any forest can be recreated alone. If dst_filepath is
+  given, then the batch is saved there as one .npy file.
+  """
+  seed_forest = load_dataframe('csv',src_filepath)
+  seed_radii = ((seed_forest['x']**2 + seed_forest['y']**2)**0.5).values
+  mean_radius, sig_radius = computeNormalStats(seed_radii)
+  logger.info("seed forest:\nmean = %2f\n sig = %2f",mean_radius,sig_radius)
+
+  n_trees = len(seed_forest)
+  batch = np.zeros(N,dtype=forest_batch_dtype(n_trees))
+  batch['id'] = first_id + np.arange(N)
+  batch['seed'] = np.random.SeedSequence(seed).generate_state(N,dtype=np.uint64)
+  new_radii = np.empty((N,n_trees))
+  new_theta = np.empty((N,n_trees))
+  for iforest in range(N):
+    rng = np.random.default_rng(int(batch['seed'][iforest]))
+    new_radii[iforest] = rng.normal(mean_radius,sig_radius,n_trees)
+    new_theta[iforest] = rng.uniform(0,2*math.pi,n_trees)
+
+  batch['trees'][:,:,0] = new_radii * np.cos(new_theta)
+  batch['trees'][:,:,1] = new_radii * np.sin(new_theta)
+  batch['trees'][:,:,2] = seed_forest['r'].values
+  # useful for debug
+  new_mean, new_sig = computeNormalStats(new_radii)
+  logger.info("batch of %d:\nmean = %2f\n sig = %2f",N,new_mean.mean(),new_sig.mean())
+
+  if (dst_filepath is not None):
+    save_forest_batch(batch,dst_filepath)
+    logger.info("saved @ %s",dst_filepath)
+  return batch
 
 def newForest(new_forest_template,mean_radius,sigma_radius):
   """
@@ -74,19 +117,19 @@ def computeNormalStats(arr):
   """
   (ndarray) -> (tuple(2))
   Given an array (column) of radii, computes and returns the mean
-  and standard deviation of the array.
+  and standard deviation of the array. For a 2d array, these are
+  computed for each row (e.g., each forest of a batch).
   >>> computeNormalStats(array)
   mean,sigma
   """
 
-  N = arr.shape[0] # expect column
+  N = arr.shape[-1] # expect column
   assert(N != 0), "computeNormalStats: can't calculate mean and sig with array size 0."
+  arr = np.asarray(arr)
   # accumulate values
-  mean = arr.sum() / N
+  mean = arr.sum(axis=-1) / N
   # accumulate squared error
-  sig = 0.
-  for a in arr:
-    sig += (a - mean)**2
+  sig = ((arr - np.expand_dims(mean,-1))**2).sum(axis=-1)
   sig = (sig/N)**0.5
 
   return mean,sig
@@ -1,47 +1,49 @@
 #!/usr/bin/python3
 
-from plotStuff import plot_frame, plot_mat
-from discretize import discretize
+from plotStuff import plot_mat
+from discretize import discretize, window_blocks, window_corrections
+import mask_store
+import bitmask
+import instrument
+import logging
+from logs import get_logger
 import numpy as np
-<<<<<<< HEAD
-import scipy.ndimage as ndimage
+from scipy.signal import fftconvolve
 import math
-import pylab
-=======
-import pandas as pd
->>>>>>> devel
 import sys
 
 PAD = 10  # pad patch for discritization
 
+logger = get_logger('score')
+
 def is_square_mat(mat):
-<<<<<<< HEAD
-   if(mat.shape[0] == 0 or mat.shape[1] == 0):
-      print("(!) Mat is flat or empty")
-      return False
-=======
   """
   (numpy.ndarray) -> bool
 
   Returns true if the lengths of each dimension in mat are equal.
   """
   if(mat.shape[0] == 0 or mat.shape[1] == 0):
-    print("(!) Mat is flat or empty")
+    logger.error("(!) Mat is flat or empty")
     return False
->>>>>>> SpaceKitKat/devel
 
-   return mat.shape[0] == mat.shape[1]
+  return mat.shape[0] == mat.shape[1]
 
 def score_frame(mask,kernel):
-<<<<<<< HEAD
-   ret = 0 # elem wise mult and sum
-   if(is_square_mat(mask) and is_square_mat(kernel)):
-     prod = np.multiply(mask,kernel)
-     ret = prod.sum()
-   # is this meaningful?
-   # represent score as percent coverage if kernel is uniform ones
-   ret = 1 - ret/mask.shape[0]/mask.shape[1]
-   return ret
+  """
+  (numpy.ndarray,numpy.ndarray) -> float
+
+  Returns the average value of an element in P, an element-wise product
+  of mask and kernel.
+  """
+  ret = 0 # elem wise mult and sum
+  if(is_square_mat(mask) and is_square_mat(kernel)):
+    prod = np.multiply(mask,kernel)
+    ret = prod.sum()
+
+  # Score reflects the average value in product of the mask and kernel.
+  # ret = 1 - ret/mask.shape[0]/mask.shape[1]
+  score = ret/mask.shape[0]/mask.shape[1]
+  return score
 
 # generates data frame slice of env objects
 # contained within a square around origin.
@@ -49,113 +51,94 @@ def score_frame(mask,kernel):
 # RETURNS: tree patch, patch size (L/2 of
 # patch, not number of trees)
 def get_patch(orig,env,partial=True):
-   patch_size = (int)(50*max(env.r)/2) + PAD # floored
-   if(not partial):
-     l = orig[0]-patch_size < env.x-env.r
-     r = env.x+env.r < orig[0]+patch_size
-     u = env.y+env.r < orig[1]+patch_size
-     d = orig[1]-patch_size < env.y-env.r
-   else:
-     l = orig[0]-patch_size < env.x+env.r
-     r = env.x-env.r < orig[0]+patch_size
-     u = env.y-env.r < orig[1]+patch_size
-     d = orig[1]-patch_size < env.y+env.r
-   patch = env[l & r & u & d]
-   return [patch, patch_size]
-
-# generate a kernel whose
-def generateKernel(ktype,size):
-   ret = np.ones((size,size),dtype=int)
-   # create vertical split
-   if(ktype == 'vertical split'):
-      split_size = int(ret.shape[0] / 10)
-      ret[(ret.shape[0]/2)-split_size:(ret.shape[0]/2)+split_size+1] = -1
-      ret = ret.T
-
-   # otherwise return uniform
-   return ret
+  patch_size = (int)(50*max(env.r)/2) + PAD # floored
+  if(not partial):
+    l = orig[0]-patch_size < env.x-env.r
+    r = env.x+env.r < orig[0]+patch_size
+    u = env.y+env.r < orig[1]+patch_size
+    d = orig[1]-patch_size < env.y-env.r
+  else:
+    l = orig[0]-patch_size < env.x+env.r
+    r = env.x-env.r < orig[0]+patch_size
+    u = env.y-env.r < orig[1]+patch_size
+    d = orig[1]-patch_size < env.y+env.r
+  patch = env[l & r & u & d]
+  return [patch, patch_size]
+
+# generate a uniform or vertically split kernel of ones
+def generateSimpleKernel(ktype,size):
+  ret = np.ones((size,size),dtype=int)
+  # create vertical split
+  if(ktype == 'vertical split'):
+    split_size = int(ret.shape[0] / 10)
+    ret[(ret.shape[0]/2)-split_size:(ret.shape[0]/2)+split_size+1] = -1
+    ret = ret.T
+
+  # otherwise return uniform
+  return ret
 
 # think about keeping data frames as is for simplicity
 def walk(dm, td, ktype='uniform', display=False):
-   cummulative_score = 0
-   min_score = sys.maxsize
-   max_score = -sys.maxsize - 1
-   # get moth xy data from data frame
-   dm = dm[['pos_x','pos_y']]
-   # make sure there are data in moth data frame
-   if(len(dm.values) == 0 or len(dm.values[0]) != 2):
-      print("(!) Cannot process traj data of size:"+str(len(dm.values))\
-         +" & len:"+str(len(dm.values[0])))
-      return 1
-   if(len(td.values) == 0 or len(td.values[0]) != 3):
-      print("(!) Cannot process tree data of size:"+str(len(td.values))\
-         +" & len:"+str(len(td.values[0])))
-      return 1
-
-   cnt = 1
-   # get mask of first point
-   [patch,sz] = get_patch(dm.loc[0],td)
-
-   [mask, bsize] = discretize(dm.loc[0],patch,sz,min(td.r))
-   # initialize kernel
-   kernel = generateKernel(ktype,mask.shape[0])
-   # initialize score
-   if(is_square_mat(mask) and is_square_mat(kernel)):
-      score = score_frame(mask,kernel)
-      if(score < min_score): min_score = score
-      if(max_score < score): max_score = score
-      cummulative_score += score
-   else:
-      print("(!) Walk: Either mask or kernel is not square")
+  cummulative_score = 0
+  min_score = sys.maxsize
+  max_score = -sys.maxsize - 1
+  # get moth xy data from data frame
+  dm = dm[['pos_x','pos_y']]
+  # make sure there are data in moth data frame
+  if(len(dm.values) == 0 or len(dm.values[0]) != 2):
+    logger.error("(!) Cannot process traj data of size:%d & len:%d"
+      ,len(dm.values),len(dm.values[0]))
+    return 1
+  if(len(td.values) == 0 or len(td.values[0]) != 3):
+    logger.error("(!) Cannot process tree data of size:%d & len:%d"
+      ,len(td.values),len(td.values[0]))
+    return 1
 
-   if(display):
-      plot_mat(mask,bsize,"initial_mask.png")
+  cnt = 1
+  # get mask of first point
+  [patch,sz] = get_patch(dm.loc[0],td)
 
-   # process other points
-   for point in dm.values[1:10]:
-      cnt += 1
-      print("pt "+str(cnt)+" ("+str(round(point[0],3))+","+str(round(point[1],3))+"):",end='')
-      # get scoring region, may contain trees
-      [patch,sz] = get_patch(point,td)
-      print("\t"+str(len(patch.values))+" ts")
-      # discretize that shit
-      [mask, bsize] = discretize(point,patch,sz,min(td.r))
+  [mask, bsize] = discretize(dm.loc[0],patch,sz,min(td.r))
+  # initialize kernel
+  kernel = generateSimpleKernel(ktype,mask.shape[0])
+  # initialize score
+  if(is_square_mat(mask) and is_square_mat(kernel)):
+    score = score_frame(mask,kernel)
+    if(score < min_score): min_score = score
+    if(max_score < score): max_score = score
+    cummulative_score += score
+  else:
+    logger.error("(!) Walk: Either mask or kernel is not square")
 
-      # update score
-      if(is_square_mat(mask) and is_square_mat(kernel)):
-         score = score_frame(mask,kernel)
-         if(score < min_score): min_score = score
-         if(max_score < score): max_score = score
-         cummulative_score += score
-      else:
-         print("(!) Either mask or kernel is not square")
+  if(display):
+    plot_mat(mask,bsize,"initial_mask.png")
 
-      if(display):
-         plot_mat(mask,bsize,"./masks/mask"+str(cnt)+".png")
+  # process other points
+  for point in dm.values[1:10]:
+    cnt += 1
+    # get scoring region, may contain trees
+    [patch,sz] = get_patch(point,td)
+    logger.debug("pt %d (%.3f,%.3f):\t%d ts",cnt,point[0],point[1],len(patch.values))
+    # discretize that shit
+    [mask, bsize] = discretize(point,patch,sz,min(td.r))
 
+    # update score
+    if(is_square_mat(mask) and is_square_mat(kernel)):
+      score = score_frame(mask,kernel)
+      if(score < min_score): min_score = score
+      if(max_score < score): max_score = score
+      cummulative_score += score
+    else:
+      logger.error("(!) Either mask or kernel is not square")
 
-   print("===== SCORE =====")
-   print("cummulative_score: "+str(cummulative_score))
-   print("min_score: "+str(min_score))
-   print("max_score: "+str(max_score))
+    if(display):
+      plot_mat(mask,bsize,"./masks/mask"+str(cnt)+".png")
 
-   return 0
-=======
-  """
-  (numpy.ndarray,numpy.ndarray) -> int
 
-  Returns the average value of an element in P, an element-wise product
-  of mask and kernel.
-  """
-  ret = 0 # elem wise mult and sum
-  if(is_square_mat(mask) and is_square_mat(kernel)):
-    prod = np.multiply(mask,kernel)
-    ret = prod.sum()
+  logger.info("===== SCORE =====\ncummulative_score: %s\nmin_score: %s\nmax_score: %s"
+    ,cummulative_score,min_score,max_score)
 
-  # Score reflects the average value in product of the mask and kernel.
-  # ret = 1 - ret/mask.shape[0]/mask.shape[1]
-  score = ret/mask.shape[0]/mask.shape[1]
-  return score
+  return 0
 
 oneDGaussian = lambda vbar,v,vsig: np.exp(-1*(vbar-v)**2 / (2*vsig**2))
 def gaussian2d(N,meanxy,sigmaxy,amp):
@@ -207,6 +190,77 @@ def gaussian2d(N,meanxy,sigmaxy,amp):
   # compute dot product of x and y
   return amp*np.dot(gaussianx,gaussiany)
 
+def generateKernelStack(N,headings,means,sigmas,amplitudes,dtype=float):
+  """
+  Compute NxN Gaussian kernels with multiple terms, rotated to each of an
+  array of headings, in one vectorized call.
+
+  The kernel terms are evaluated directly in rotated coordinates, so
+  there is no interpolation: edges stay sharp and corners are not
+  clipped. The kernel for heading 0 is generateKernel's unrotated
+  kernel, and a heading turns the kernel's x axis (rows) toward y
+  (columns). If the lengths of Gaussian parameters don't match, then
+  None is returned.
+
+  Parameters
+  ----------
+  N : int
+    Size of each kernel.
+  headings : array_like
+    Headings in radians, e.g., numpy.arctan2(hy,hx).
+  means : array_like
+    An array of tuples that specify xmean and ymean respectively, as in
+    generateKernel.
+  sigmas : array_like
+    An array of tuples that specify standard deviation for x and y
+    respectively, as in generateKernel.
+  amplitudes : array_like
+    An array of floats that specify amplitude to be used for each
+    Gaussian term, as in generateKernel.
+  dtype : data-type, optional
+    Type the kernels are computed in; float32 halves memory use. By
+    default, this is float.
+
+  Returns
+  -------
+  kernels : array_like
+    A (len(headings),N,N) stack of kernels.
+
+  Examples
+  --------
+  >>> kernels = generateKernelStack(5,[0,math.pi/2],[(0,0)],[(10,10)],[1])
+  >>> kernels.shape
+  (2, 5, 5)
+  >>> bool(np.allclose(kernels[0],generateKernel([5,0,0],[(0,0)],[(10,10)],[1])))
+  True
+  """
+  M = len(means)
+  if (M <= 0 or len(sigmas) != M or len(amplitudes) != M):
+    logger.error("""(!) score.generateKernelStack: Lengths of Gaussian parameter arrays
+    don't match; len of means,sigs,amps = %d,%d,%d""",len(means)
+      ,len(sigmas)
+      ,len(amplitudes))
+    return None
+
+  theta = np.asarray(headings,dtype=float).reshape(-1,1,1)
+  # same domain as gaussian2d; rows are x and columns are y
+  domain = np.linspace(-N//2,(N//2)+1,N)
+  center = (domain[0]+domain[-1])/2
+  dx = (domain-center).reshape(1,N,1)
+  dy = (domain-center).reshape(1,1,N)
+  # sample the unrotated kernel at the points rotated back by each heading
+  cos,sin = np.cos(theta),np.sin(theta)
+  x = (center + dx*cos + dy*sin).astype(dtype)
+  y = (center - dx*sin + dy*cos).astype(dtype)
+
+  kernels = np.zeros((theta.shape[0],N,N),dtype=dtype)
+  # Normalize the kernel by M, as in generateKernel
+  for term in range(M):
+    xbar,ybar = means[term][0],means[term][1]
+    xsig,ysig = sigmas[term][0],sigmas[term][1]
+    kernels += (1./M)*amplitudes[term]*oneDGaussian(xbar,x,xsig)*oneDGaussian(ybar,y,ysig)
+  return kernels
+
 def generateKernel(ksize_and_hxhy,means,sigmas,amplitudes,rotate=False):
   """
   Compute an NxN Gaussian kernel with multiple terms.
@@ -216,7 +270,8 @@ def generateKernel(ksize_and_hxhy,means,sigmas,amplitudes,rotate=False):
   then the kernel is rotated by headingx and headingy contained in
   `ksize_and_hxhy`. Also, kernel size, N, is defined by `ksize_and_hxhy[0]`.
 
-  (!) NOTE: rotation is currently done AFTER the kernel is discretized.
+  Rotated kernels come from generateKernelStack, which evaluates the
+  terms in rotated coordinates at the heading atan2(headingy,headingx).
 
   Parameters
   ----------
@@ -267,34 +322,32 @@ def generateKernel(ksize_and_hxhy,means,sigmas,amplitudes,rotate=False):
 
   """
   if (ksize_and_hxhy == None or len(ksize_and_hxhy) != 3):
-    print("""(!) score.generateKernel: Invalid ksize_and_hxhy length.
+    logger.error("""(!) score.generateKernel: Invalid ksize_and_hxhy length.
     Needs 3; [N,headingx,headingy].""")
-   return None
+    return None
 
   M = len(means)
   if (M <= 0):
-    print("""(!) score.generateKernel: Invalid length {:d} for Gaussian
-    parameters.""".format(M))
+    logger.error("""(!) score.generateKernel: Invalid length %d for Gaussian
+    parameters.""",M)
   if (len(sigmas) != M or len(amplitudes) != M):
-    print("""(!) score.generateKernel: Lengths of Gaussian parameter arrays
-    don't match; len of means,sigs,amps = {:d},{:d},{:d}""".format(len(means)
+    logger.error("""(!) score.generateKernel: Lengths of Gaussian parameter arrays
+    don't match; len of means,sigs,amps = %d,%d,%d""",len(means)
       ,len(sigmas)
-      ,len(amplitudes)))
+      ,len(amplitudes))
     return None
 
   N = ksize_and_hxhy[0]
+  if (rotate):
+    theta_rad = math.atan2(ksize_and_hxhy[2],ksize_and_hxhy[1])
+    return generateKernelStack(N,[theta_rad],means,sigmas,amplitudes)[0]
+
   kernel = np.zeros((N,N),dtype=float)
 
   # Normalize the kernel by M... not sure if this is what should be done
   for term in range(M):
     kernel += (1./M)*gaussian2d(N,means[term],sigmas[term],amplitudes[term])
 
-  if (rotate):
-    theta_rad = math.atan(ksize_and_hxhy[2]/ksize_and_hxhy[1])
-    theta_deg = 180*theta_rad/math.pi
-    kernel = ndimage.interpolation.rotate(kernel,theta_deg
-      ,mode='nearest',reshape=False)
-
   # # let's check out what the kernel looks like
   # x = np.linspace(-N//2,(N//2)+1,N)
   # y = np.linspace(-N//2,(N//2)+1,N)
@@ -303,7 +356,161 @@ def generateKernel(ksize_and_hxhy,means,sigmas,amplitudes,rotate=False):
 
   return kernel
 
-def score_trial(trial_data,tcnt,desc,kernel_params):
+def generateKernelBank(N,kernel_params,nheadings=360,dtype=float,max_bytes=2**30):
+  """
+  Precompute a kernel for each of `nheadings` evenly spaced heading bins.
+
+  Kernel k is generateKernel's kernel rotated to the heading
+  2*pi*k/nheadings. All kernels are evaluated at once by
+  generateKernelStack. Frames are matched to bins with bank_kernels.
+  If the bank would take more than `max_bytes`, then None is returned.
+
+  Parameters
+  ----------
+  N : int
+    Size of the NxN kernels; this must match the mask size.
+  kernel_params : array_like
+    The means, sigmas and amplitudes of the kernel, as in score_trial.
+  nheadings : int, optional
+    Number of heading bins over a full turn. By default, this is 360.
+  dtype : data-type, optional
+    Type of the kernel values; float32 halves the bank's memory. By
+    default, this is float.
+  max_bytes : int, optional
+    Largest bank, in bytes, that may be built. By default, this is 1 GiB.
+
+  Returns
+  -------
+  bank : dict
+    The (nheadings,N,N) 'kernels', the 'headings' of the bins in radians,
+    and 'nbytes', the memory taken by the kernels.
+
+  Examples
+  --------
+  >>> bank = generateKernelBank(5,[[(0,0)],[(2,1)],[1]],nheadings=8)
+  >>> bank['kernels'].shape, bank['nbytes']
+  ((8, 5, 5), 1600)
+  """
+  nbytes = nheadings*N*N*np.dtype(dtype).itemsize
+  if (max_bytes < nbytes):
+    logger.error("""(!) score.generateKernelBank: %d kernels of %dx%d need %d
+    bytes; max_bytes is %d.""",nheadings,N,N,nbytes,max_bytes)
+    return None
+
+  headings = 2*math.pi*np.arange(nheadings)/nheadings
+  kernels = generateKernelStack(N,headings
+    ,kernel_params[0]
+    ,kernel_params[1]
+    ,kernel_params[2]
+    ,dtype=dtype)
+
+  return {'kernels':kernels
+    ,'headings':headings
+    ,'nbytes':kernels.nbytes}
+
+def bank_kernels(bank,hx,hy,interpolate=False):
+  """
+  Look up the kernels of a kernel bank for arrays of heading vectors.
+
+  Each heading, atan2(hy,hx), is mapped to a position among the bank's
+  heading bins. By default, the kernel of the nearest bin is used. If
+  `interpolate` is true, then the kernels of the two neighboring bins are
+  blended linearly by the heading's distance to each.
+
+  Parameters
+  ----------
+  bank : dict
+    A kernel bank from generateKernelBank.
+  hx, hy : array_like
+    X and y components of the headings.
+  interpolate : bool, optional
+    Blend neighboring bins instead of picking the nearest. By default,
+    this is False.
+
+  Returns
+  -------
+  kernels : array_like
+    A (len(hx),N,N) stack of kernels.
+  """
+  kernels = bank['kernels']
+  nheadings = len(kernels)
+  if (not interpolate):
+    return kernels[heading_bins(nheadings,hx,hy)]
+  theta = np.arctan2(np.asarray(hy,dtype=float),np.asarray(hx,dtype=float))
+  position = (theta % (2*math.pi))*nheadings/(2*math.pi)
+
+  lower = np.floor(position).astype(np.int64)
+  weight = (position - lower).reshape(-1,1,1).astype(kernels.dtype)
+  return (1-weight)*kernels[lower % nheadings] + weight*kernels[(lower+1) % nheadings]
+
+def heading_bins(nheadings,hx,hy):
+  """
+  Map heading vectors to the nearest of `nheadings` evenly spaced bins.
+
+  Parameters
+  ----------
+  nheadings : int
+    Number of heading bins over a full turn, as in generateKernelBank.
+  hx, hy : array_like
+    X and y components of the headings.
+
+  Returns
+  -------
+  bins : array_like
+    The bin of each heading, in [0,nheadings).
+
+  Examples
+  --------
+  >>> heading_bins(4,[1,0,-1,1],[0,1,0,-0.01])
+  array([0, 1, 2, 0])
+  """
+  theta = np.arctan2(np.asarray(hy,dtype=float),np.asarray(hx,dtype=float))
+  position = (theta % (2*math.pi))*nheadings/(2*math.pi)
+  return np.rint(position).astype(np.int64) % nheadings
+
+def distinct_frames(trial_masks,headings=None):
+  """
+  Find the frames of a trial that share a mask.
+
+  generate_trial_masks.discretize_trial packs frames with the same mask
+  key as references to one sparse matrix, so frames are grouped by the
+  identity of their mask and, if given, by a heading key (e.g., the bin of
+  a rotated kernel). A frame's score only depends on its group.
+
+  Parameters
+  ----------
+  trial_masks : array_like
+    Sparse masks, e.g., the 'mat' field of a trial.
+  headings : array_like, optional
+    A hashable heading key per frame. By default, headings are ignored.
+
+  Returns
+  -------
+  first : array_like
+    The first frame of each group, in frame order.
+  inverse : array_like
+    The group of each frame, so that group values expand to frame
+    values with values[inverse].
+
+  Examples
+  --------
+  >>> a,b = np.eye(2),np.ones((2,2))
+  >>> distinct_frames([a,a,b,a])
+  (array([0, 2]), array([0, 0, 1, 0]))
+  """
+  groups = {}
+  first = []
+  inverse = np.empty(len(trial_masks),dtype=np.int64)
+  for iframe,sparse_mask in enumerate(trial_masks):
+    key = id(sparse_mask) if headings is None else (id(sparse_mask),headings[iframe])
+    igroup = groups.get(key)
+    if (igroup is None):
+      igroup = groups[key] = len(first)
+      first.append(iframe)
+    inverse[iframe] = igroup
+  return np.array(first,dtype=np.int64),inverse
+
+def score_trial(trial_data,tcnt,desc,kernel_params,display=False):
   """
   Generate a list of scores, one score value for each frame within a trial.
 
@@ -331,6 +538,13 @@ def score_trial(trial_data,tcnt,desc,kernel_params):
     xysigmas - an array of tuples (i.e., [(s0x,s0y),...,(sTx,sTy)])
     amplitudes - an array of int  (i.e., [a0,...,aT])
     These arrays should have the same length, T.
+  display : bool, optional
+    If true, then the first 100 masks are plotted into ./masks. By
+    default, this is False.
+
+  Frames that refer to the same mask as an earlier frame (see
+  distinct_frames) reuse its score. Kernel generation, densifying and
+  scoring are timed, and frames are counted, when instrument is enabled.
 
   Returns
   -------
@@ -373,19 +587,11 @@ def score_trial(trial_data,tcnt,desc,kernel_params):
   >>> handle.close()
   """
 
-  print("-----------------")
-  print("Scoring: t{:d}".format(tcnt))
-  print("Conditions:\n\tmoth_id={:s}\n\tflight_speed={:f}\n\tfogmin={:f}\n\tfogmax={:f}"
-    .format(desc[0]
-      ,desc[1]
-      ,desc[2]
-      ,desc[3])
-  )
-  print("Kernel paramters:\n\tmeans={:s}\n\tsigmas={:s}\n\tamps={:s}"
-    .format(str(kernel_params[0])
-      ,str(kernel_params[1])
-      ,str(kernel_params[2]))
-  )
+  logger.info("-----------------\nScoring: t%d"
+    "\nConditions:\n\tmoth_id=%s\n\tflight_speed=%f\n\tfogmin=%f\n\tfogmax=%f"
+    "\nKernel paramters:\n\tmeans=%s\n\tsigmas=%s\n\tamps=%s"
+    ,tcnt,desc[0],desc[1],desc[2],desc[3]
+    ,kernel_params[0],kernel_params[1],kernel_params[2])
 
   # extract masks and block size
   data = trial_data[0]
@@ -397,17 +603,29 @@ def score_trial(trial_data,tcnt,desc,kernel_params):
   # score discretized frames of trajectory
   scores = [0]*len(trial_masks)
   imask = 0 # mask count
+  # scores of masks shared by several frames, keyed by mask; the kernel
+  # is rotated once, by the first heading, so it is the same for every frame
+  mask_scores = {}
   # initialize kernel
   ksize_and_hxhy = [trial_masks[0].shape[0],headingxs[0],headingys[0]]
+  t0 = instrument.start()
   kernel = generateKernel(ksize_and_hxhy
     ,kernel_params[0]
     ,kernel_params[1]
     ,kernel_params[2]
     ,rotate=True)
+  instrument.stop('generateKernel',t0)
 
   # score each mask in trial masks
   for sparse_mask in trial_masks:
+    key = id(sparse_mask)
+    if (key in mask_scores and not (display and imask < 100)):
+      scores[imask] = mask_scores[key]
+      imask += 1
+      continue
+    t0 = instrument.start()
     mask = sparse_mask.toarray()
+    instrument.stop('toarray',t0)
     if (kernel_params == 'rotated'):
       # refresh kernel
       ksize_and_hxhy = [trial_masks[imask].shape[0]
@@ -419,34 +637,505 @@ def score_trial(trial_data,tcnt,desc,kernel_params):
         ,kernel_params[2]
         ,rotate=True)
 
-  # visualize loaded masks
-  if (display and imask < 100):
-    plot_mat(mask,bsize,"./masks/"+desc[0]
-      +'-'+str(int(desc[1]))
-      +'-'+str(int(desc[2]))
-      +'-'+str(int(desc[3]))
-      +'-t'+str(tcnt)
-      +'-'+str(imask)+".png")
-
-  # get score
-  scores[imask] = score_frame(mask,kernel)
-  imask += 1
-
-  print("===== SCORE =====")
-  print("masks processed: "+str(imask))
-  print("cummulative_score: "+str(sum(scores[0:imask])))
-  print("min_score: "+str(min(scores[0:imask])))
-  print("max_score: "+str(max(scores[0:imask])))
+    # visualize loaded masks
+    if (display and imask < 100):
+      plot_mat(mask,block_size,"./masks/"+desc[0]
+        +'-'+str(int(desc[1]))
+        +'-'+str(int(desc[2]))
+        +'-'+str(int(desc[3]))
+        +'-t'+str(tcnt)
+        +'-'+str(imask)+".png")
+
+    # get score
+    t0 = instrument.start()
+    scores[imask] = score_frame(mask,kernel)
+    instrument.stop('score_frame',t0)
+    mask_scores[key] = scores[imask]
+    imask += 1
+
+  instrument.count('frames_scored',imask)
+  # the summary is only reduced when it will be logged
+  if (logger.isEnabledFor(logging.INFO)):
+    logger.info("===== SCORE =====\nmasks processed: %d\ncummulative_score: %s\nmin_score: %s\nmax_score: %s"
+      ,imask,sum(scores[0:imask]),min(scores[0:imask]),max(scores[0:imask]))
 
   return scores[0:imask]
 
+def stack_masks(trial_masks,start=0,stop=None,out=None):
+  """
+  Densify a range of sparse masks into one contiguous (frames,N,N) array.
+
+  The stored blocks of every mask in the range are gathered and written
+  into the stack with one fancy index per block size.
+
+  Parameters
+  ----------
+  trial_masks : array_like
+    Sparse NxN masks, e.g., the 'mat' field of a trial packed by
+    generate_trial_masks.discretize_and_save.
+  start : int, optional
+    Index of the first mask to densify. By default, this is 0.
+  stop : int, optional
+    One past the index of the last mask to densify. By default, masks
+    are densified to the end of `trial_masks`.
+  out : array_like, optional
+    A float (frames,N,N) buffer to fill so that chunks can reuse it. Only
+    its first stop-start frames are used.
+
+  Returns
+  -------
+  masks : array_like
+    A float (stop-start,N,N) array of masks.
+  """
+  stop = len(trial_masks) if stop is None else min(stop,len(trial_masks))
+  nframes = stop - start
+  N = trial_masks[start].shape[0]
+  if (out is None):
+    out = np.zeros((nframes,N,N),dtype=float)
+  else:
+    out = out[:nframes]
+    out.fill(0)
+
+  # masks may be packed with different block sizes, so group them by it
+  groups = {}
+  for iframe in range(nframes):
+    sparse_mask = trial_masks[start+iframe].tobsr()
+    groups.setdefault(sparse_mask.blocksize,[]).append((iframe,sparse_mask))
+
+  for (R,C),members in groups.items():
+    iframes = np.array([iframe for iframe,sparse_mask in members])
+    sparse_masks = [sparse_mask for iframe,sparse_mask in members]
+    # count the stored blocks in each block row of each mask
+    indptrs = np.stack([sparse_mask.indptr for sparse_mask in sparse_masks])
+    blocks_per_row = np.diff(indptrs,axis=1)
+    block_rows = np.repeat(np.tile(np.arange(blocks_per_row.shape[1]),len(members))
+      ,blocks_per_row.reshape(-1))
+    block_cols = np.concatenate([sparse_mask.indices for sparse_mask in sparse_masks])
+    block_frames = np.repeat(iframes,indptrs[:,-1])
+    blocks = np.concatenate([sparse_mask.data for sparse_mask in sparse_masks])
+    # scatter every stored block of the group at once
+    out[block_frames.reshape(-1,1,1)
+      ,block_rows.reshape(-1,1,1)*R + np.arange(R).reshape(1,R,1)
+      ,block_cols.reshape(-1,1,1)*C + np.arange(C).reshape(1,1,C)] = blocks
+  return out
+
+def score_masks(masks,kernel):
+  """
+  Score a stack of masks with one tensor contraction.
+
+  Each score is the average value of the element-wise product of a mask
+  and a kernel, as in score_frame.
+
+  Parameters
+  ----------
+  masks : array_like
+    A (frames,N,N) stack of masks.
+  kernel : array_like
+    Either one NxN kernel applied to every mask, or a (frames,N,N) stack
+    with one kernel per mask (e.g., kernels rotated by heading).
+
+  Returns
+  -------
+  scores : array_like
+    A length frames array of score values.
+
+  Examples
+  --------
+  >>> masks = np.ones((2,3,3))
+  >>> masks[1,1,1] = -1
+  >>> score_masks(masks,np.ones((3,3)))
+  array([1.        , 0.77777778])
+  """
+  if (kernel.ndim == 2):
+    ret = np.tensordot(masks,kernel,axes=([1,2],[0,1]))
+  else:
+    ret = np.einsum('fij,fij->f',masks,kernel)
+  return ret/masks.shape[1]/masks.shape[2]
+
+def score_trial_batched(trial_data,kernel_params,chunk_size=1024,bank=None,interpolate=False):
+  """
+  Generate an array of scores, one for each frame within a trial, in batches.
+
+  This computes the same scores as score_trial, with the same kernel, but
+  densifies `chunk_size` masks at a time into a (frames,N,N) stack and
+  scores the stack with score_masks. Nothing is printed.
+  If a kernel bank is given, then each frame is instead scored against
+  the bank's kernel for the frame's heading (hx,hy), which costs the
+  same as scoring with one kernel.
+  Frames that share a mask (and heading bin, or heading if interpolated)
+  are densified and scored once (see distinct_frames).
+
+  Parameters
+  ----------
+  trial_data : array_like
+    A list of a trial array and its bin size, as in score_trial.
+  kernel_params : array_like
+    The means, sigmas and amplitudes of the kernel, as in score_trial.
+  chunk_size : int, optional
+    Maximum number of masks held densely at once. By default, this is 1024.
+  bank : dict, optional
+    A kernel bank from generateKernelBank. If given, `kernel_params` is
+    not used.
+  interpolate : bool, optional
+    Blend the bank's neighboring heading bins (see bank_kernels). By
+    default, this is False.
+
+  Returns
+  -------
+  scores : array_like
+    An array of score values for each frame in the trial.
+  """
+  data = trial_data[0]
+  trial_masks = data['mat']
+  nframes = len(trial_masks)
+  N = trial_masks[0].shape[0]
+  if (bank is None):
+    # the kernel is rotated by the heading of the first frame, as in score_trial
+    kernel = generateKernel([N,data['hx'][0],data['hy'][0]]
+      ,kernel_params[0]
+      ,kernel_params[1]
+      ,kernel_params[2]
+      ,rotate=True)
+  elif (bank['kernels'].shape[1] != N):
+    logger.error("(!) score.score_trial_batched: Bank kernels are %dx%d but masks are %dx%d."
+      ,bank['kernels'].shape[1],bank['kernels'].shape[2],N,N)
+    return None
+
+  # score each distinct (mask,kernel) pair once
+  if (bank is None):
+    headings = None
+  elif (interpolate):
+    headings = list(zip(data['hx'].tolist(),data['hy'].tolist()))
+  else:
+    headings = heading_bins(len(bank['kernels']),data['hx'],data['hy']).tolist()
+  first,inverse = distinct_frames(trial_masks,headings)
+  distinct_masks = trial_masks[first]
+  ndistinct = len(first)
+
+  scores = np.zeros(ndistinct,dtype=float)
+  chunk = np.empty((min(chunk_size,ndistinct),N,N),dtype=float)
+  for start in range(0,ndistinct,chunk_size):
+    masks = stack_masks(distinct_masks,start,start+chunk_size,out=chunk)
+    if (bank is not None):
+      frames = first[start:start+len(masks)]
+      kernel = bank_kernels(bank,data['hx'][frames],data['hy'][frames],interpolate)
+    scores[start:start+len(masks)] = score_masks(masks,kernel)
+  return scores[inverse]
+
+def score_bits(bits,kernel,chunk_size=1024):
+  """
+  Score a bit-packed stack of masks against one kernel.
+
+  The scores are those of score_masks on the unpacked stack. If every
+  nonzero cell of the kernel has the same value (a uniform or box
+  kernel), then each score is a popcount of the mask bitplanes and'ed
+  with the kernel's support, and no mask is unpacked. Otherwise, masks
+  are unpacked `chunk_size` at a time and scored with score_masks.
+
+  Parameters
+  ----------
+  bits : dict
+    A packed stack from bitmask.pack_masks.
+  kernel : array_like
+    An NxN kernel.
+  chunk_size : int, optional
+    Maximum number of masks unpacked at once. By default, this is 1024.
+
+  Returns
+  -------
+  scores : array_like
+    A length frames array of score values.
+
+  Examples
+  --------
+  >>> bits = bitmask.pack_masks(np.array([[[1,0],[-1,1]]]))
+  >>> score_bits(bits,np.ones((2,2)))
+  array([0.25])
+  """
+  N = bits['n_bins']
+  support,value = bitmask.pack_support(kernel)
+  if (support is not None):
+    covered = bitmask.popcount(bits['occupancy'] & support) - bitmask.popcount(bits['markers'] & support)
+    return value*covered/N/N
+
+  nframes = len(bits['occupancy'])
+  scores = np.zeros(nframes,dtype=float)
+  chunk = np.empty((min(chunk_size,nframes),N,N),dtype=float)
+  for start in range(0,nframes,chunk_size):
+    masks = bitmask.unpack_masks(bits,start,start+chunk_size,out=chunk)
+    scores[start:start+len(masks)] = score_masks(masks,kernel)
+  return scores
+
+def score_stored_trial(store,itrial,kernel_params,start=0,stop=None,chunk_size=1024,bank=None,interpolate=False):
+  """
+  Generate an array of scores for a range of frames of a trial in a mask store.
+
+  This computes the same scores as score_trial_batched, but reads masks
+  and headings from a store opened with mask_store.load_mask_store. Only
+  the requested frames are read, so a memory-mapped store never has to
+  be loaded whole.
+
+  Parameters
+  ----------
+  store : dict
+    A mask store from mask_store.load_mask_store.
+  itrial : int
+    Row of the trial in the store's trials table (see mask_store.find_trials).
+  kernel_params : array_like
+    The means, sigmas and amplitudes of the kernel, as in score_trial.
+  start : int, optional
+    First frame of the trial to score. By default, this is 0.
+  stop : int, optional
+    One past the last frame of the trial to score. By default, frames
+    are scored to the end of the trial.
+  chunk_size : int, optional
+    Maximum number of masks held densely at once. By default, this is 1024.
+  bank : dict, optional
+    A kernel bank from generateKernelBank, as in score_trial_batched.
+  interpolate : bool, optional
+    Blend the bank's neighboring heading bins (see bank_kernels). By
+    default, this is False.
+
+  Returns
+  -------
+  scores : array_like
+    An array of score values for each frame in the range.
+  """
+  trial_start,trial_stop = mask_store.trial_frames(store,itrial)
+  first = trial_start + start
+  last = trial_stop if stop is None else min(trial_start+stop,trial_stop)
+  nframes = max(last-first,0)
+  N = int(store['trials']['n_bins'][itrial])
+  if (bank is None):
+    # the kernel is rotated by the heading of the trial's first frame, as in score_trial
+    pose = mask_store.read_poses(store,trial_start,trial_start+1)
+    kernel = generateKernel([N,pose['hx'][0],pose['hy'][0]]
+      ,kernel_params[0]
+      ,kernel_params[1]
+      ,kernel_params[2]
+      ,rotate=True)
+  elif (bank['kernels'].shape[1] != N):
+    logger.error("(!) score.score_stored_trial: Bank kernels are %dx%d but masks are %dx%d."
+      ,bank['kernels'].shape[1],bank['kernels'].shape[2],N,N)
+    return None
+
+  scores = np.zeros(nframes,dtype=float)
+  chunk = np.empty((min(chunk_size,nframes),N,N),dtype=float)
+  for offset in range(0,nframes,chunk_size):
+    chunk_stop = min(first+offset+chunk_size,last)
+    masks = mask_store.read_masks(store,first+offset,chunk_stop,out=chunk)
+    if (bank is not None):
+      pose = mask_store.read_poses(store,first+offset,chunk_stop)
+      kernel = bank_kernels(bank,pose['hx'],pose['hy'],interpolate)
+    scores[offset:offset+len(masks)] = score_masks(masks,kernel)
+  return scores
+
+def generateKernelMatrix(ksize_and_hxhy,kernel_param_sets,rotate=False,dtype=float):
+  """
+  Stack the kernels of K Gaussian parameter sets into a (K,N*N) matrix.
+
+  Row k is generateKernel(ksize_and_hxhy,*kernel_param_sets[k],rotate)
+  flattened, so that masks can be scored against every kernel with one
+  matrix multiply. If any parameter set is invalid, then None is returned.
+
+  Parameters
+  ----------
+  ksize_and_hxhy : array_like
+    Kernel size, x heading and y heading, as in generateKernel.
+  kernel_param_sets : array_like
+    A list of K [means,sigmas,amplitudes] parameter sets. The number of
+    terms may differ between sets.
+  rotate : bool, optional
+    Rotate every kernel by the heading, as in generateKernel. By
+    default, this is False.
+  dtype : data-type, optional
+    Type of the matrix. By default, this is float.
+
+  Returns
+  -------
+  kernels : array_like
+    A (K,N*N) matrix of flattened kernels.
+
+  Examples
+  --------
+  >>> sets = [[[(0,0)],[(10,10)],[1]], [[(0,0),(5,5)],[(1,1),(1,1)],[1,2]]]
+  >>> generateKernelMatrix([5,1,0],sets).shape
+  (2, 25)
+  """
+  N = ksize_and_hxhy[0]
+  kernels = np.empty((len(kernel_param_sets),N*N),dtype=dtype)
+  for k,kernel_params in enumerate(kernel_param_sets):
+    kernel = generateKernel(ksize_and_hxhy
+      ,kernel_params[0]
+      ,kernel_params[1]
+      ,kernel_params[2]
+      ,rotate=rotate)
+    if (kernel is None):
+      logger.error("(!) score.generateKernelMatrix: Invalid kernel parameter set %d.",k)
+      return None
+    kernels[k] = kernel.reshape(-1)
+  return kernels
+
+def score_masks_kernels(masks,kernels):
+  """
+  Score a stack of masks against K kernels with one matrix multiply.
+
+  Parameters
+  ----------
+  masks : array_like
+    A (frames,N,N) stack of masks.
+  kernels : array_like
+    A (K,N*N) matrix of flattened kernels, e.g., from generateKernelMatrix.
+
+  Returns
+  -------
+  scores : array_like
+    A (K,frames) matrix; row k holds score_masks(masks,kernel k).
+  """
+  N2 = masks.shape[1]*masks.shape[2]
+  ret = np.dot(kernels,masks.reshape(-1,N2).T)
+  return ret/masks.shape[1]/masks.shape[2]
+
+def score_trial_kernels(trial_data,kernel_param_sets,chunk_size=1024):
+  """
+  Score every frame of a trial against K kernels in one pass over the masks.
+
+  Each chunk of masks is densified once and scored against all kernels
+  with score_masks_kernels, so a population of kernels costs about one
+  pass over the trial. The kernels are rotated by the heading of the
+  first frame, as in score_trial, so row k equals
+  score_trial_batched(trial_data,kernel_param_sets[k]).
+  Frames that share a mask are densified and scored once.
+
+  Parameters
+  ----------
+  trial_data : array_like
+    A list of a trial array and its bin size, as in score_trial.
+  kernel_param_sets : array_like
+    A list of K [means,sigmas,amplitudes] parameter sets.
+  chunk_size : int, optional
+    Maximum number of masks held densely at once. By default, this is 1024.
+
+  Returns
+  -------
+  scores : array_like
+    A (K,frames) matrix of score values.
+  """
+  data = trial_data[0]
+  trial_masks = data['mat']
+  nframes = len(trial_masks)
+  N = trial_masks[0].shape[0]
+  kernels = generateKernelMatrix([N,data['hx'][0],data['hy'][0]]
+    ,kernel_param_sets
+    ,rotate=True)
+  if (kernels is None):
+    return None
+
+  # frames that share a mask share its scores (see distinct_frames)
+  first,inverse = distinct_frames(trial_masks)
+  distinct_masks = trial_masks[first]
+  ndistinct = len(first)
+  scores = np.zeros((len(kernels),ndistinct),dtype=float)
+  chunk = np.empty((min(chunk_size,ndistinct),N,N),dtype=float)
+  for start in range(0,ndistinct,chunk_size):
+    masks = stack_masks(distinct_masks,start,start+chunk_size,out=chunk)
+    scores[:,start:start+len(masks)] = score_masks_kernels(masks,kernels)
+  return scores[:,inverse]
+
+def raster_block(grid,imin,jmin,nrows,ncols):
+  """
+  Copy a block of a forest raster as floats, padding it with zeros
+  wherever it reaches past the raster.
+
+  Parameters
+  ----------
+  grid : array_like
+    The 'grid' of a raster from discretize.rasterize_forest.
+  imin, jmin : int
+    Raster indices of the first row and column of the block.
+  nrows, ncols : int
+    Shape of the block.
+
+  Returns
+  -------
+  block : array_like
+    A float (nrows,ncols) array.
+  """
+  block = np.zeros((nrows,ncols),dtype=float)
+  gi0,gi1 = max(imin,0),min(imin+nrows,grid.shape[0])
+  gj0,gj1 = max(jmin,0),min(jmin+ncols,grid.shape[1])
+  if (gi0 < gi1 and gj0 < gj1):
+    block[gi0-imin:gi1-imin,gj0-jmin:gj1-jmin] = grid[gi0:gi1,gj0:gj1]
+  return block
+
+def score_trial_fft(raster,traj,kernel_params,tile_size=256,corrections=None):
+  """
+  Score every point of a trajectory with an unrotated kernel by correlating
+  the kernel with a forest raster.
+
+  With an unrotated kernel, the score of a point is the correlation of the
+  kernel and the forest raster at the point's block, so no per-frame masks
+  are built. The raster is processed in tiles of `tile_size` x `tile_size`
+  blocks that hold trajectory points. Each tile is read with a halo of
+  half a kernel on every side and correlated with one FFT, so memory use
+  is bounded by the tile size rather than the forest size. The blocks of
+  trees that get_patch drops from a point's patch and the moth block are
+  then corrected with one sparse product (see
+  discretize.window_corrections), so scores are the same as score_masks
+  gives for discretize.get_window(raster,point,copy=True) masks, to
+  within FFT round-off. The corrections do not depend on the kernel, so
+  they may be computed once and passed in when scoring many kernels.
+
+  Parameters
+  ----------
+  raster : dict
+    A forest raster from discretize.rasterize_forest.
+  traj : array_like
+    A (frames,2) or wider array, or DataFrame, whose first two columns
+    are x and y.
+  kernel_params : array_like
+    The means, sigmas and amplitudes of the kernel, as in score_trial.
+  tile_size : int, optional
+    Side length, in blocks, of the tiles correlated at once. By default,
+    this is 256.
+  corrections : scipy.sparse.csr_matrix, optional
+    The discretize.window_corrections of `traj`. By default, these are
+    computed here.
+
+  Returns
+  -------
+  scores : array_like
+    An array of score values for each point in `traj`.
+  """
+  points = np.asarray(traj.values if hasattr(traj,'values') else traj,dtype=float)
+  grid = raster['grid']
+  N = raster['n_bins']
+  center = int(N/2)
+  kernel = generateKernel([N,0,0]
+    ,kernel_params[0]
+    ,kernel_params[1]
+    ,kernel_params[2])
+  # correlating with the kernel is convolving with the flipped kernel
+  flipped_kernel = kernel[::-1,::-1]
+
+  # bin points as discretize.get_window does
+  ibins,jbins = window_blocks(raster,points)
+  if (corrections is None):
+    corrections = window_corrections(raster,points)
+
+  scores = np.zeros(len(points),dtype=float)
+  tiles = {}
+  for ipoint,tile in enumerate(zip((ibins//tile_size).tolist(),(jbins//tile_size).tolist())):
+    tiles.setdefault(tile,[]).append(ipoint)
+  for (itile,jtile),members in tiles.items():
+    imin,jmin = itile*tile_size,jtile*tile_size
+    block = raster_block(grid,imin-center,jmin-center,tile_size+N-1,tile_size+N-1)
+    correlation = fftconvolve(block,flipped_kernel,mode='valid')
+    scores[members] = correlation[ibins[members]-imin,jbins[members]-jmin]
+  scores += corrections @ kernel.reshape(-1)
+  return scores/N/N
+
 """ DOC TESTS """
 if __name__ == "__main__":
-<<<<<<< HEAD
   import doctest
   doctest.testmod()
-=======
-   import doctest
-   doctest.testmod()
->>>>>>> SpaceKitKat/devel
->>>>>>> devel
@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+
+"""
+Genetic search for the scoring function, i.e., the means, sigmas and
+amplitudes of the Gaussian terms passed to score.generateKernel. An
+individual is a flat list of N_TERMS*(mean x, mean y, sigma x, sigma y,
+amplitude). Its fitness is how well its scores separate real trials from
+the same trials in random forests: the mean, over trials, of the
+absolute z-score of the trial's mean score in the real forest against
+its scores in the random forests.
+
+Masks of every trial in the real and random forests are computed once
+(see null_scores.forest_masks) and shared by all individuals, so a
+fitness evaluation only builds kernels and rescores sparse masks.
+Fitnesses are memoized by canonical parameters, the population is
+evaluated in parallel through toolbox.map, and every generation is
+checkpointed so that an interrupted search resumes where it stopped.
+"""
+
+import random
+import pickle
+import os
+import numpy as np
+
+from deap import base
+from deap import creator
+from deap import tools
+from deap import algorithms
+
+from fileio import load_dataframe, load_forest_batch
+from logs import get_logger
+import null_scores
+
+logger = get_logger('searchKernels')
+
+N_TERMS = 2  # Gaussian terms per kernel
+# (low,high) of each gene of a term, in kernel blocks
+MEAN_BOUNDS = (-20.,20.)
+SIGMA_BOUNDS = (0.5,20.)
+AMP_BOUNDS = (-2.,2.)
+TERM_BOUNDS = [MEAN_BOUNDS,MEAN_BOUNDS,SIGMA_BOUNDS,SIGMA_BOUNDS,AMP_BOUNDS]
+CANON_DECIMALS = 6  # parameters equal to this many decimals share a fitness
+
+creator.create("FitnessMax",base.Fitness,weights=(1.0,))
+creator.create("Individual",list,fitness=creator.FitnessMax)
+
+def decode(individual):
+  """
+  (list) -> list
+
+  Turns an individual into [means,sigmas,amplitudes] for generateKernel.
+  """
+  terms = np.asarray(individual,dtype=float).reshape(-1,len(TERM_BOUNDS))
+  return [[(t[0],t[1]) for t in terms]
+    ,[(t[2],t[3]) for t in terms]
+    ,[t[4] for t in terms]]
+
+def canonical_key(individual):
+  """
+  (list) -> tuple
+
+  Returns a key that is the same for individuals with the same kernel:
+  genes are rounded, and the order of terms, which does not change their
+  sum, is sorted away.
+
+  >>> canonical_key([1,2,3,4,5,0,0,1,1,1]) == canonical_key([0,0,1,1,1,1,2,3,4,5])
+  True
+  """
+  terms = np.round(np.asarray(individual,dtype=float).reshape(-1,len(TERM_BOUNDS)),CANON_DECIMALS)
+  return tuple(sorted(tuple(t) for t in terms.tolist()))
+
+def preload(trial_paths,forest,batch_path,forest_indices):
+  """
+  (array of str,pandas.dataframe,str,array_like) -> list
+
+  Prepares each trial (see null_scores.prepare_trial) and computes its
+  sparse masks in the real forest and in the given forests of a batch.
+  Raises a ValueError if a batch forest's radii bounds differ from those
+  of the real forest, since its masks would have another size.
+  """
+  batch = load_forest_batch(batch_path)
+  data = []
+  for trial_path in trial_paths:
+    traj = load_dataframe("h5",trial_path)
+    prep = null_scores.prepare_trial(traj,forest,[])
+    real = null_scores.forest_masks(prep,forest[['x','y','r']].values)
+    null = []
+    for i in forest_indices:
+      masks = null_scores.forest_masks(prep,np.array(batch[i]['trees']))
+      if (masks is None):
+        raise ValueError("(!) ERROR: the tree radii of forest {} (index {:d}) differ from the real forest's."
+          .format(batch[i]['id'],i))
+      null.append(masks)
+    data.append({'prep':prep,'real':real,'null':null})
+    logger.info("preloaded %s: %d forests",trial_path,len(null))
+  return data
+
+def separation(data,kernel_params):
+  """
+  (list,list) -> float
+
+  Returns the mean absolute z-score of the real forest's mean trial score
+  against the random forests' mean trial scores, over the preloaded trials.
+  """
+  zscores = []
+  for trial in data:
+    prep = trial['prep']
+    kernels,empty_scores = null_scores.trial_kernels(prep,[kernel_params])
+    if (kernels is None):
+      return 0.
+    observed = null_scores.score_forest_masks(prep,trial['real'],kernels,empty_scores).mean()
+    null = np.array([null_scores.score_forest_masks(prep,masks,kernels,empty_scores).mean()
+      for masks in trial['null']])
+    sigma = null.std()
+    zscores.append(abs(observed-null.mean())/sigma if 0 < sigma else 0.)
+  return float(np.mean(zscores))
+
+# preloaded masks shared by the worker processes
+worker_search = {}
+
+def init_worker(data):
+  """
+  (list) -> None
+
+  Stores the preloaded masks in a worker process once.
+  """
+  worker_search['data'] = data
+
+def evaluate(individual):
+  """
+  (list) -> (float,)
+
+  DEAP fitness of an individual with the worker's preloaded masks.
+  """
+  return (separation(worker_search['data'],decode(individual)),)
+
+def clip(individual):
+  """
+  (list) -> list
+
+  Keeps every gene of an individual within its bounds.
+  """
+  for igene in range(len(individual)):
+    low,high = TERM_BOUNDS[igene % len(TERM_BOUNDS)]
+    individual[igene] = min(max(individual[igene],low),high)
+  return individual
+
+def random_gene(igene):
+  """
+  (int) -> float
+
+  Draws gene igene of a new individual uniformly within its bounds.
+  """
+  low,high = TERM_BOUNDS[igene % len(TERM_BOUNDS)]
+  return random.uniform(low,high)
+
+def make_toolbox():
+  """
+  () -> deap.base.Toolbox
+
+  Registers the genetic operators of the search. Mutated and crossed
+  individuals are clipped to the gene bounds.
+  """
+  toolbox = base.Toolbox()
+  ngenes = N_TERMS*len(TERM_BOUNDS)
+  toolbox.register("individual",lambda: creator.Individual(random_gene(i) for i in range(ngenes)))
+  toolbox.register("population",tools.initRepeat,list,toolbox.individual)
+  toolbox.register("evaluate",evaluate)
+  toolbox.register("mate",lambda a,b: tuple(clip(c) for c in tools.cxBlend(a,b,alpha=0.5)))
+  toolbox.register("mutate",lambda a: (clip(tools.mutGaussian(a,mu=0.,sigma=1.,indpb=0.2)[0]),))
+  toolbox.register("select",tools.selTournament,tournsize=3)
+  toolbox.register("map",map)
+  return toolbox
+
+def evaluate_population(toolbox,individuals,memo):
+  """
+  (deap.base.Toolbox,list,dict) -> int
+
+  Sets the fitness of individuals without one. Fitnesses already in memo,
+  by canonical_key, are reused; the rest are evaluated with toolbox.map
+  (once per distinct key) and added to memo. Returns the number evaluated.
+  """
+  pending = {}
+  for ind in individuals:
+    if (not ind.fitness.valid):
+      key = canonical_key(ind)
+      if (key in memo):
+        ind.fitness.values = memo[key]
+      else:
+        pending.setdefault(key,[]).append(ind)
+  keys = list(pending.keys())
+  fitnesses = toolbox.map(toolbox.evaluate,[pending[key][0] for key in keys])
+  for key,fit in zip(keys,fitnesses):
+    memo[key] = fit
+    for ind in pending[key]:
+      ind.fitness.values = fit
+  return len(keys)
+
+def save_checkpoint(checkpoint_path,state):
+  """
+  (str,dict) -> None
+
+  Pickles the search state, writing a temporary file first so that an
+  interruption never leaves a partial checkpoint.
+  """
+  with open(checkpoint_path+'.tmp','wb') as handle:
+    pickle.dump(state,handle)
+  os.replace(checkpoint_path+'.tmp',checkpoint_path)
+
+def search(data,ngen,pop_size=50,cxpb=0.5,mutpb=0.3,checkpoint_path=None,workers=1,seed=None):
+  """
+  (list,int,int,float,float,str,int,int) -> dict
+
+  Runs a generational search (as deap.algorithms.eaSimple) on preloaded
+  masks for ngen generations and returns its state: the population, a
+  hall of fame of the best individuals, the logbook and the fitness memo.
+  If checkpoint_path exists, then the search resumes from it; the state is
+  saved there after every generation. With workers > 1, fitnesses are
+  evaluated by a pool of that many processes.
+  """
+  toolbox = make_toolbox()
+  pool = None
+  if (1 < workers):
+    import multiprocessing
+    pool = multiprocessing.Pool(workers,initializer=init_worker,initargs=(data,))
+    toolbox.register("map",pool.map)
+  else:
+    init_worker(data)
+
+  # the workers are stopped at once if the search fails
+  try:
+    if (checkpoint_path is not None and os.path.isfile(checkpoint_path)):
+      with open(checkpoint_path,'rb') as handle:
+        state = pickle.load(handle)
+      random.setstate(state['rndstate'])
+      logger.info("resuming at generation %d",state['generation'])
+    else:
+      random.seed(seed)
+      state = {'generation':0
+        ,'population':toolbox.population(n=pop_size)
+        ,'halloffame':tools.HallOfFame(5)
+        ,'logbook':tools.Logbook()
+        ,'memo':{}}
+      state['logbook'].header = ['gen','nevals','avg','max']
+
+    stats = tools.Statistics(lambda ind: ind.fitness.values[0])
+    stats.register("avg",np.mean)
+    stats.register("max",np.max)
+    population = state['population']
+    for gen in range(state['generation'],ngen+1):
+      if (0 < gen):
+        offspring = toolbox.select(population,len(population))
+        population = algorithms.varAnd(offspring,toolbox,cxpb,mutpb)
+      nevals = evaluate_population(toolbox,population,state['memo'])
+      state['halloffame'].update(population)
+      state['logbook'].record(gen=gen,nevals=nevals,**stats.compile(population))
+      logger.info("%s",state['logbook'].stream)
+
+      state['population'] = population
+      state['generation'] = gen+1
+      state['rndstate'] = random.getstate()
+      if (checkpoint_path is not None):
+        save_checkpoint(checkpoint_path,state)
+  except BaseException:
+    if (pool is not None):
+      pool.terminate()
+      pool.join()
+    raise
+  if (pool is not None):
+    pool.close()
+    pool.join()
+  return state
+
+def main():
+  FOREST_LOC = "../data/forests/forest.csv"
+  BATCH_LOC = "../data/forests/random_batch.npy" # see randomForests.createForestBatch
+  TRIALS = ["../data/single_trials/moth1_448f0.h5"]
+  N_FORESTS = 100 # random forests per trial
+  CHECKPOINT = "../data/kernel_search.pickle"
+  WORKERS = 1
+  NGEN = 40
+
+  forest = load_dataframe("csv",FOREST_LOC)
+  data = preload(TRIALS,forest,BATCH_LOC,range(N_FORESTS))
+  state = search(data,NGEN,checkpoint_path=CHECKPOINT,workers=WORKERS)
+  for ind in state['halloffame']:
+    logger.info("%f: %s",ind.fitness.values[0],decode(ind))
+  return
+
+if (__name__ == "__main__"):
+  main()